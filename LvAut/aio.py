@@ -0,0 +1,140 @@
+"""asyncio versions of `play()`, `rec()` and `playrec()`.
+
+The blocking convenience functions of `LvAut.device` wait on a
+`threading.Event`; the coroutines here instead resolve a future from the
+stream's *finished_callback* with `loop.call_soon_threadsafe`, so one
+event loop can drive many streams (on different devices) at once::
+
+    import asyncio
+    import LvAut.aio as aio
+
+    async def station():
+        recording, _ = await asyncio.gather(
+            aio.arec(48000, samplerate=48000, channels=1, device='Mic A'),
+            aio.aplay(stimulus, 48000, device='Speaker B'))
+
+Cancelling the awaiting task aborts the stream.  Unlike `play()`,
+`rec()` and `playrec()`, these do not stop a previous invocation, and
+`device.wait()`/`device.stop()` do not apply to them.
+
+"""
+import asyncio as _asyncio
+
+from . import device as _device
+
+__all__ = ['aplay', 'arec', 'aplayrec']
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+async def _run(ctx, StreamClass, samplerate, channels, dtype, callback,
+               **kwargs):
+    """Run a stream for *ctx* until its finished_callback fires."""
+    loop = _asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def finished_callback():
+        ctx.finished_callback()
+        try:
+            loop.call_soon_threadsafe(_resolve, future)
+        except RuntimeError:
+            pass  # the event loop was closed meanwhile
+
+    ctx.stream = StreamClass(samplerate=samplerate, channels=channels,
+                             dtype=dtype, callback=callback,
+                             finished_callback=finished_callback, **kwargs)
+    try:
+        ctx.stream.start()
+        await future
+    except BaseException:
+        # including asyncio.CancelledError
+        ctx.stream.abort()
+        raise
+    finally:
+        ctx.stream.close()
+    return ctx.status if ctx.status else None
+
+
+async def aplay(data, samplerate=None, mapping=None, loop=False, **kwargs):
+    """Play back a NumPy array, see `LvAut.device.play()`.
+
+    Returns
+    -------
+    CallbackFlags or None
+        Over-/underrun status as returned by `LvAut.device.wait()`.
+
+    """
+    ctx = _device._CallbackContext(loop=loop)
+    ctx.frames = ctx.check_data(data, mapping, kwargs.get('device'))
+
+    def callback(outdata, frames, time, status):
+        assert len(outdata) == frames
+        ctx.callback_enter(status, outdata)
+        ctx.write_outdata(outdata)
+        ctx.callback_exit()
+
+    return await _run(ctx, _device.OutputStream, samplerate,
+                      ctx.output_channels, ctx.output_dtype, callback,
+                      **kwargs)
+
+
+async def arec(frames=None, samplerate=None, channels=None, dtype=None,
+               out=None, mapping=None, **kwargs):
+    """Record into a NumPy array, see `LvAut.device.rec()`.
+
+    Returns
+    -------
+    numpy.ndarray or type(out)
+        The recorded data, complete once the coroutine returns.
+
+    """
+    ctx = _device._CallbackContext()
+    out, ctx.frames = ctx.check_out(out, frames, channels, dtype, mapping)
+
+    def callback(indata, frames, time, status):
+        assert len(indata) == frames
+        ctx.callback_enter(status, indata)
+        ctx.read_indata(indata)
+        ctx.callback_exit()
+
+    await _run(ctx, _device.InputStream, samplerate, ctx.input_channels,
+               ctx.input_dtype, callback, **kwargs)
+    return out
+
+
+async def aplayrec(data, samplerate=None, channels=None, dtype=None,
+                   out=None, input_mapping=None, output_mapping=None,
+                   **kwargs):
+    """Simultaneous playback and recording, see `LvAut.device.playrec()`.
+
+    Returns
+    -------
+    numpy.ndarray or type(out)
+        The recorded data, complete once the coroutine returns.
+
+    """
+    ctx = _device._CallbackContext()
+    output_frames = ctx.check_data(data, output_mapping, kwargs.get('device'))
+    if dtype is None:
+        dtype = ctx.data.dtype  # ignore module defaults
+    out, input_frames = ctx.check_out(out, output_frames, channels, dtype,
+                                      input_mapping)
+    if input_frames != output_frames:
+        raise ValueError('len(data) != len(out)')
+    ctx.frames = input_frames
+
+    def callback(indata, outdata, frames, time, status):
+        assert len(indata) == len(outdata) == frames
+        ctx.callback_enter(status, indata)
+        ctx.read_indata(indata)
+        ctx.write_outdata(outdata)
+        ctx.callback_exit()
+
+    await _run(ctx, _device.Stream, samplerate,
+               (ctx.input_channels, ctx.output_channels),
+               (ctx.input_dtype, ctx.output_dtype), callback,
+               prime_output_buffers_using_stream_callback=False, **kwargs)
+    return out
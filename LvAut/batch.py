@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+'''Parallel batch analysis of WAV captures (``lvaut-batch``)
+   lorry rui , Newark , USA
+
+Runs the sweep THD / power / rub&buzz analysis, the tonal noise count and
+the range limits of ``wav_file_test_sample.py`` on every WAV file of a
+directory or glob, fanned out over a process pool, and streams one result
+row per file to CSV or JSON lines as results arrive::
+
+    python -m LvAut.batch captures/ -o results.csv --workers 8
+    python -m LvAut.batch "captures/**/*_THD_*.wav" -o results.jsonl
+'''
+
+import argparse
+import concurrent.futures
+import csv
+import functools
+import glob
+import json
+import os
+import sys
+
+import numpy as np
+
+from . import cache
+from . import limits
+from . import lvspectrum as lvs
+from . import thd as AUT
+from . import time_frequency as core
+
+
+__all__ = ['expand_paths', 'analyze_file', 'run', 'main']
+
+# STFT used for the tonal noise count, as in Tona_noise_test.py
+TONAL_HOP_SIZE = 512
+TONAL_FRAME_SIZE = 2048
+
+FIELDS = ['file', 'freq', 'thdh', 'thd_N', 'power', 'rub_buzz',
+          'thd_max', 'thd_min', 'thd_margin', 'thd_worst_freq', 'thd_result',
+          'power_max', 'power_min', 'power_margin', 'power_worst_freq',
+          'power_result',
+          'tonal_noise', 'result', 'error']
+
+
+def expand_paths(patterns, recursive=False):
+    '''Sorted list of WAV files from directories and/or glob patterns.'''
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            sub = ('**', '*') if recursive else ('*',)
+            matches = [f for f in glob.glob(os.path.join(pattern, *sub),
+                                            recursive=recursive)
+                       if f.lower().endswith('.wav')]
+        else:
+            matches = glob.glob(pattern, recursive=True)
+        files.extend(sorted(f for f in matches if os.path.isfile(f)))
+    return files
+
+
+def check_range(freq, data, start_Freq, end_Freq, lowlimit, uplimit):
+    '''``checkdata`` of ``wav_file_test_sample.py`` with `LvAut.limits`.
+
+    Returns ``maxval, minval, margin, worst_freq, result`` of *data* for
+    the points with ``start_Freq <= freq <= end_Freq``; every point in
+    the range has to be within the limits.  An empty range fails.
+    '''
+    freq, data = np.asarray(freq), np.asarray(data)
+    in_range = data[(freq >= start_Freq) & (freq <= end_Freq)]
+    if not in_range.size:
+        return None, None, None, None, 'fail'
+    res = limits.range_limit(start_Freq, end_Freq, lowlimit,
+                             uplimit).check(freq, data)
+    return (float(np.max(in_range)), float(np.min(in_range)),
+            float(res.margin), float(res.worst_freq),
+            'pass' if res.passed else 'fail')
+
+
+def tonal_noise(y, sr, area_start=2000, area_stop=5000, threshold=-40):
+    '''Number of spectrogram cells in ``[area_start, area_stop)`` above
+    *threshold* dB (relative to the loudest cell).'''
+    db = cache.stft_db(y, n_fft=TONAL_FRAME_SIZE,
+                       hop_length=TONAL_HOP_SIZE, ref=np.max)
+    a1, a2 = core.hz_to_fft_bin([area_start, area_stop], sr,
+                                TONAL_FRAME_SIZE)
+    return int(np.count_nonzero(db[a1:a2] > threshold))
+
+
+def analyze_file(filename, channel=1, trigeFrequncy=400, stopananlysis=100,
+                 thd_range=(200, 10000), thd_limit=(0, 10),
+                 power_range=(200, 4500), power_limit=(-70, -40),
+                 tonal_area=None, tonal_threshold=-40):
+    '''Analyze one capture; returns a flat ``dict`` with the `FIELDS`.
+
+    Errors are reported in the ``'error'`` field instead of raised, so one
+    broken capture does not stop a batch.
+    '''
+    row = dict.fromkeys(FIELDS)
+    row['file'] = filename
+    try:
+        y, sr = AUT.load_channel(filename, channel)
+        (freq, thdh, thd_N, power, Freq_THD, thd_data, Freq_Power, PowerS,
+         RubBuzz_data) = AUT.analyze_sweep_data(y, sr, trigeFrequncy,
+                                                stopananlysis)
+        row.update(freq=float(freq), thdh=float(thdh), thd_N=float(thd_N),
+                   power=float(power),
+                   rub_buzz=float(np.max(RubBuzz_data))
+                   if len(RubBuzz_data) else None)
+
+        for name, freqs, data, (start, end), (low, up) in (
+                ('thd', Freq_THD, thd_data, thd_range, thd_limit),
+                ('power', Freq_Power, PowerS, power_range, power_limit)):
+            keys = [name + key for key in ('_max', '_min', '_margin',
+                                           '_worst_freq', '_result')]
+            row.update(zip(keys, check_range(freqs, data, start, end,
+                                             low, up)))
+        passed = row['thd_result'] == row['power_result'] == 'pass'
+
+        if tonal_area is not None:
+            row['tonal_noise'] = tonal_noise(y, sr, tonal_area[0],
+                                             tonal_area[1], tonal_threshold)
+        row['result'] = 'pass' if passed else 'fail'
+    except Exception as e:
+        row['result'] = 'error'
+        row['error'] = '{}: {}'.format(type(e).__name__, e)
+    return row
+
+
+class _CsvWriter(object):
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._writer = csv.DictWriter(stream, fieldnames=FIELDS)
+        self._writer.writeheader()
+
+    def write(self, row):
+        self._writer.writerow(row)
+        self._stream.flush()
+
+
+class _JsonlWriter(object):
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def write(self, row):
+        self._stream.write(json.dumps(row) + '\n')
+        self._stream.flush()
+
+
+_writers = {'csv': _CsvWriter, 'jsonl': _JsonlWriter}
+
+
+def run(files, stream, fmt='csv', workers=None, chunksize=1, **kwargs):
+    '''Analyze *files* in a process pool and write rows to *stream*.
+
+    Rows are written in the order of *files* as soon as they are
+    available; *chunksize* files are sent to a worker at a time.  With
+    ``workers=1`` everything runs in this process.  Keyword arguments are
+    passed to `analyze_file`.
+
+    :return: number of ``(passed, failed, errors)`` files
+    '''
+    try:
+        writer = _writers[fmt](stream)
+    except KeyError:
+        raise lvs.ParameterError('Invalid format: {!r}'.format(fmt))
+
+    job = functools.partial(analyze_file, **kwargs)
+    counts = {'pass': 0, 'fail': 0, 'error': 0}
+    if workers == 1:
+        for row in map(job, files):
+            writer.write(row)
+            counts[row['result']] += 1
+    else:
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            for row in executor.map(job, files, chunksize=chunksize):
+                writer.write(row)
+                counts[row['result']] += 1
+    return counts['pass'], counts['fail'], counts['error']
+
+
+def _parser():
+    parser = argparse.ArgumentParser(
+        prog='lvaut-batch',
+        description='Sweep THD / power / rub&buzz / tonal noise analysis '
+                    'of many WAV captures in parallel.')
+    parser.add_argument('paths', nargs='+',
+                        help='directories and/or glob patterns of WAV files')
+    parser.add_argument('-o', '--output', default='-',
+                        help='result file (.csv or .jsonl), default stdout')
+    parser.add_argument('--format', choices=sorted(_writers),
+                        help='output format, default from the extension')
+    parser.add_argument('-r', '--recursive', action='store_true',
+                        help='search directories recursively')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='worker processes, default one per core')
+    parser.add_argument('--chunksize', type=int, default=4,
+                        help='files sent to a worker at a time')
+    parser.add_argument('--channel', type=int, default=1)
+    parser.add_argument('--trigger', type=float, default=400,
+                        help='trigger tone frequency [Hz]')
+    parser.add_argument('--stop', type=float, default=100,
+                        help='lowest sweep frequency analyzed [Hz]')
+    parser.add_argument('--thd-range', type=float, nargs=2,
+                        default=(200, 10000), metavar=('LOW', 'HIGH'))
+    parser.add_argument('--thd-limit', type=float, nargs=2,
+                        default=(0, 10), metavar=('LOW', 'UP'))
+    parser.add_argument('--power-range', type=float, nargs=2,
+                        default=(200, 4500), metavar=('LOW', 'HIGH'))
+    parser.add_argument('--power-limit', type=float, nargs=2,
+                        default=(-70, -40), metavar=('LOW', 'UP'))
+    parser.add_argument('--tonal-area', type=float, nargs=2, default=None,
+                        metavar=('START', 'STOP'),
+                        help='count tonal noise in this band [Hz]')
+    parser.add_argument('--tonal-threshold', type=float, default=-40)
+    return parser
+
+
+def main(argv=None):
+    '''``lvaut-batch`` command line entry point.'''
+    args = _parser().parse_args(argv)
+    files = expand_paths(args.paths, recursive=args.recursive)
+    if not files:
+        sys.exit('No WAV files found')
+
+    fmt = args.format
+    if fmt is None:
+        fmt = 'jsonl' if args.output.lower().endswith(
+            ('.jsonl', '.json')) else 'csv'
+
+    kwargs = dict(workers=args.workers, chunksize=args.chunksize,
+                  channel=args.channel, trigeFrequncy=args.trigger,
+                  stopananlysis=args.stop, thd_range=args.thd_range,
+                  thd_limit=args.thd_limit, power_range=args.power_range,
+                  power_limit=args.power_limit, tonal_area=args.tonal_area,
+                  tonal_threshold=args.tonal_threshold)
+    if args.output == '-':
+        counts = run(files, sys.stdout, fmt, **kwargs)
+    else:
+        with open(args.output, 'w', newline='') as stream:
+            counts = run(files, stream, fmt, **kwargs)
+    print('{} files: {} pass, {} fail, {} error'.format(len(files), *counts),
+          file=sys.stderr)
+    return 0 if counts[1] == counts[2] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+'''Content-addressed on-disk cache of analysis results
+   lorry rui , Newark , USA
+
+Results of the analysis entry points (`LvAut.thd.analyze_sweep_data`,
+`track_sweep`, `rub_buzz`, ...) are stored under a key hashed from the
+audio samples and all analysis parameters, so a retest or a report of the
+same capture loads the ``.npz`` instead of recomputing the STFT::
+
+    import LvAut.cache
+    LvAut.cache.enable('/data/lvaut-cache', max_size=2 * 2**30)
+
+The cache lives in ``$LVAUT_CACHE_DIR`` (default ``~/.cache/lvaut``) and
+is bounded to ``$LVAUT_CACHE_SIZE`` bytes (default 1 GiB) by evicting the
+least recently used entries.  It is off unless enabled with `enable()` or
+``LVAUT_CACHE=1`` (inherited by batch workers).  Entries are written to a
+temporary file and renamed into place, so concurrent batch workers never
+see a partial entry.  A failed read falls back to computing the result;
+a failed write (e.g. the directory is not writable) turns the cache off
+with one warning.
+'''
+
+import functools
+import hashlib
+import inspect
+import os
+import tempfile
+import warnings
+
+import numpy as np
+
+from . import lvspectrum as lvs
+
+
+__all__ = ['enable', 'disable', 'enabled', 'clear', 'info', 'key',
+           'memoize', 'stft_db']
+
+# bump to invalidate all entries when a cached analysis changes
+CACHE_VERSION = 1
+
+# writes between full walks that resync the size with other processes
+RESCAN_INTERVAL = 256
+
+_config = {
+    'enabled': os.environ.get('LVAUT_CACHE', '0') not in ('', '0'),
+    'path': os.environ.get('LVAUT_CACHE_DIR',
+                           os.path.join(os.path.expanduser('~'), '.cache',
+                                        'lvaut')),
+    'max_size': int(os.environ.get('LVAUT_CACHE_SIZE', 2**30)),
+}
+
+# running estimate of the cache size (None: unknown, walk on next write)
+_size = {'total': None, 'writes': 0}
+
+
+def enable(path=None, max_size=None):
+    '''Turn the cache on, optionally in *path* and bounded to *max_size*
+    bytes.'''
+    if path is not None:
+        _config['path'] = path
+        _size['total'] = None
+    if max_size is not None:
+        _config['max_size'] = int(max_size)
+    _config['enabled'] = True
+
+
+def disable():
+    '''Turn the cache off; analysis functions always compute.'''
+    _config['enabled'] = False
+
+
+def enabled():
+    return _config['enabled']
+
+
+def _entries():
+    '''``(mtime, size, path)`` of all entries.'''
+    entries = []
+    for root, _, files in os.walk(_config['path']):
+        for name in files:
+            if not name.endswith(('.npz', '.npy')):
+                continue
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                # removed by another process
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+    return entries
+
+
+def info():
+    '''``(entries, total_bytes)`` currently in the cache.'''
+    entries = _entries()
+    return len(entries), sum(size for _, size, _ in entries)
+
+
+def clear():
+    '''Remove all entries.'''
+    for _, _, path in _entries():
+        _remove(path)
+    _size['total'] = None
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _evict():
+    entries = _entries()
+    total = sum(size for _, size, _ in entries)
+    # oldest access first; hits refresh the mtime.  Evict down to 90 %
+    # so a full cache is not walked again on the next write
+    if total > _config['max_size']:
+        low = 0.9 * _config['max_size']
+        for _, size, path in sorted(entries):
+            if total <= low:
+                break
+            _remove(path)
+            total -= size
+    _size['total'] = total
+    _size['writes'] = 0
+
+
+def _added(path):
+    '''Account for a new entry; walk the tree only when the estimate
+    exceeds the bound (or every `RESCAN_INTERVAL` writes).'''
+    _size['writes'] += 1
+    if _size['total'] is not None:
+        try:
+            _size['total'] += os.path.getsize(path)
+        except OSError:
+            _size['total'] = None
+    if (_size['total'] is None or _size['total'] > _config['max_size'] or
+            _size['writes'] >= RESCAN_INTERVAL):
+        _evict()
+
+
+def _canonical(value):
+    # a representation that is the same in every process
+    if callable(value):
+        qualname = getattr(value, '__qualname__', None)
+        # lambdas, closures, partials and bound methods have no name that
+        # identifies their behaviour across calls and processes
+        if (qualname is None or '<' in qualname or
+                inspect.ismethod(value)):
+            raise lvs.ParameterError(
+                'Cannot key {!r}: not a module-level function'.format(value))
+        return '{}.{}'.format(getattr(value, '__module__', ''), qualname)
+    if isinstance(value, np.ndarray):
+        return hashlib.blake2b(np.ascontiguousarray(value).tobytes(),
+                               digest_size=20).hexdigest()
+    if isinstance(value, (tuple, list)):
+        return type(value)(_canonical(v) for v in value)
+    return value
+
+
+def key(name, y, **params):
+    '''Hex digest of the analysis *name*, the samples of *y* and
+    *params*.
+
+    Callable parameters must be named module-level functions; others
+    raise `ParameterError` and are not cached.
+    '''
+    y = np.ascontiguousarray(y)
+    params = sorted((k, _canonical(v)) for k, v in params.items())
+    h = hashlib.blake2b(digest_size=20)
+    h.update(repr((CACHE_VERSION, name, y.dtype.str, y.shape,
+                   params)).encode('utf-8'))
+    h.update(memoryview(y).cast('B'))
+    return h.hexdigest()
+
+
+def _path(digest, ext):
+    return os.path.join(_config['path'], digest[:2], digest + ext)
+
+
+def _load(path, loader):
+    try:
+        value = loader(path)
+        # refresh the LRU position
+        os.utime(path)
+        return value
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _store(path, saver):
+    '''Write atomically: temporary file in the same directory, then
+    rename over the final name.'''
+    try:
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                saver(f)
+            os.replace(tmp, path)
+        except BaseException:
+            _remove(tmp)
+            raise
+        _added(path)
+    except OSError as e:
+        # e.g. not writable: warn once instead of on every call
+        _config['enabled'] = False
+        warnings.warn('LvAut cache disabled, not written to {}: {}'
+                      .format(_config['path'], e))
+
+
+def _load_result(path):
+    with np.load(path, allow_pickle=False) as data:
+        values = tuple(data['arr_{}'.format(i)][()]
+                       for i in range(int(data['n'])))
+        return values if bool(data['tuple']) else values[0]
+
+
+def _save_result(result):
+    values = result if isinstance(result, tuple) else (result,)
+
+    def saver(f):
+        np.savez(f, n=len(values), tuple=isinstance(result, tuple),
+                 **{'arr_{}'.format(i): np.asarray(v)
+                    for i, v in enumerate(values)})
+    return saver
+
+
+def memoize(function):
+    '''Cache the result of ``function(y, sr, *args, **kwargs)``.
+
+    The result (an array, a scalar or a tuple of them) is looked up by
+    `key` over the samples of *y* and all bound arguments including
+    defaults.
+    '''
+    signature = inspect.signature(function)
+    name = '{}.{}'.format(function.__module__, function.__qualname__)
+
+    @functools.wraps(function)
+    def wrapper(y, *args, **kwargs):
+        if not _config['enabled']:
+            return function(y, *args, **kwargs)
+        bound = signature.bind(y, *args, **kwargs)
+        bound.apply_defaults()
+        params = dict(bound.arguments)
+        del params[next(iter(signature.parameters))]
+        try:
+            path = _path(key(name, y, **params), '.npz')
+        except lvs.ParameterError:
+            return function(y, *args, **kwargs)
+
+        result = _load(path, _load_result)
+        if result is None:
+            result = function(y, *args, **kwargs)
+            _store(path, _save_result(result))
+        return result
+    return wrapper
+
+
+def stft_db(y, **kwargs):
+    '''`LvAut.lvspectrum.stft_db` through the cache.
+
+    The dB spectrogram is stored as ``.npy`` and returned as a read-only
+    memory map (on a miss too, once stored), so large spectrograms are
+    only paged in where used.  With *out* given the cache is bypassed and
+    *out* is filled.
+    '''
+    if not _config['enabled'] or kwargs.get('out') is not None:
+        return lvs.stft_db(y, **kwargs)
+    kwargs.pop('out', None)
+    try:
+        path = _path(key('lvspectrum.stft_db', y, **kwargs), '.npy')
+    except lvs.ParameterError:
+        return lvs.stft_db(y, **kwargs)
+    loader = functools.partial(np.load, mmap_mode='r')
+    S = _load(path, loader)
+    if S is None:
+        S = lvs.stft_db(y, **kwargs)
+        _store(path, lambda f: np.save(f, S))
+        stored = _load(path, loader)
+        if stored is not None:
+            S = stored
+    return S
@@ -25,8 +25,18 @@ API overview:
     `play()`, `rec()`, `playrec()` and the related functions
     `wait()`, `stop()`, `get_status()`, `get_stream()`
 
+  * Record straight to a WAV file with constant memory:
+    `rec_file()`, `playrec_file()`
+
+  * Repeated stimulus/capture cycles on one open stream: `Session`
+
+  * asyncio coroutines: `aio.aplay()`, `aio.arec()`, `aio.aplayrec()`
+
+  * Callback timing and xrun statistics: `Stream.stats()`,
+    `default.stats`, `default.stats_file`
+
   * Functions to get information about the available hardware:
-    `query_devices()`, `query_hostapis()`,
+    `query_devices()`, `query_hostapis()`, `refresh()`,
     `check_input_settings()`, `check_output_settings()`
 
   * Module-wide default settings: `default`
@@ -44,6 +54,10 @@ API overview:
     `sleep()`, `get_portaudio_version()`, `CallbackFlags`,
     `CallbackStop`, `CallbackAbort`
 
+The environment variable ``LVAUT_AUDIO_BACKEND=loopback`` replaces
+PortAudio by the virtual device of `LvAut.loopback` (a simulated DUT
+between output and input, no audio hardware needed).
+
 Online documentation:
     https://python-sounddevice.readthedocs.io/
 
@@ -54,6 +68,7 @@ import atexit as _atexit
 import os as _os
 import platform as _platform
 import sys as _sys
+import time as _time
 from ctypes.util import find_library as _find_library
 try:
     import _cffi_backend
@@ -72,11 +87,21 @@ _ffi = _cffi_backend.FFI('_sounddevice',
 )
     
 
-try:
-    _lib = _ffi.dlopen(_os.path.join(
-        _os.path.dirname(_os.path.abspath(__file__)), 'portaudio.dll'))
-except Exception:
-    _lib = _ffi.dlopen('portaudio')
+_backend = _os.environ.get('LVAUT_AUDIO_BACKEND', 'portaudio')
+if _backend == 'portaudio':
+    try:
+        _lib = _ffi.dlopen(_os.path.join(
+            _os.path.dirname(_os.path.abspath(__file__)), 'portaudio.dll'))
+    except Exception:
+        _lib = _ffi.dlopen('portaudio')
+else:
+    # An in-process replacement of the PortAudio library, e.g. the
+    # virtual loopback device of LvAut.loopback (for tests without audio
+    # hardware):
+    import importlib as _importlib
+    if _backend == 'loopback':
+        _backend = __name__.rpartition('.')[0] + '.loopback'
+    _lib = _importlib.import_module(_backend).Library(_ffi)
 
 _sampleformats = {
     'float32': _lib.paFloat32,
@@ -89,6 +114,7 @@ _sampleformats = {
 
 _initialized = 0
 _last_callback = None
+_registry = None
 
 
 def play(data, samplerate=None, mapping=None, blocking=False, loop=False,
@@ -368,6 +394,109 @@ def playrec(data, samplerate=None, channels=None, dtype=None,
     return out
 
 
+def rec_file(filename, frames=None, samplerate=None, channels=None,
+             dtype=None, mapping=None, subtype='PCM_24', blocking=False,
+             buffer_seconds=2.0, **kwargs):
+    """Record audio data directly into a WAV file.
+
+    Like `rec()`, but instead of preallocating an array for the whole
+    recording, the callback pushes each block into a lock-free ring
+    buffer which a writer thread appends to *filename*.  Memory use is
+    constant regardless of the duration, and the file header is updated
+    periodically, so an interrupted recording keeps what was written.
+    Files larger than 4 GiB are written as RF64.
+
+    Parameters
+    ----------
+    filename : str
+        WAV file to write.
+    frames : int, optional
+        Number of frames to record.  If not given, record until `stop()`
+        is called.
+    channels, dtype, mapping, blocking
+        See `rec()`.
+    subtype : {'PCM_16', 'PCM_24', 'PCM_32', 'FLOAT', 'DOUBLE'}, optional
+        Sample format of the file.
+    buffer_seconds : float, optional
+        Length of the ring buffer.  If the disk stalls for longer than
+        this, frames are dropped and counted in the ``overflows`` and
+        ``dropped`` attributes of the returned recorder.
+
+    Returns
+    -------
+    LvAut.recorder.WavRecorder
+        The recorder; its ``frames`` attribute counts the frames written.
+        Use `wait()` to make sure the file is complete.
+
+    Other Parameters
+    ----------------
+    samplerate, **kwargs
+        All parameters of `InputStream` -- except *callback* and
+        *finished_callback* -- can be used.
+
+    See Also
+    --------
+    rec, playrec_file
+
+    """
+    ctx = _CallbackContext()
+    ctx.frames = ctx.check_recorder(filename, frames, samplerate, channels,
+                                    dtype, mapping, subtype, buffer_seconds,
+                                    kwargs.get('device'))
+
+    def callback(indata, frames, time, status):
+        assert len(indata) == frames
+        ctx.callback_enter(status, indata)
+        ctx.push_indata(indata)
+        ctx.callback_exit()
+
+    ctx.start_stream(InputStream, ctx.samplerate, ctx.input_channels,
+                     ctx.input_dtype, callback, blocking, **kwargs)
+    return ctx.recorder
+
+
+def playrec_file(data, filename, samplerate=None, channels=None, dtype=None,
+                 input_mapping=None, output_mapping=None, subtype='PCM_24',
+                 blocking=False, buffer_seconds=2.0, **kwargs):
+    """Play back *data* and record simultaneously into a WAV file.
+
+    Combination of `playrec()` and `rec_file()`: the recording has the
+    length of *data* and is streamed to *filename* with constant memory.
+
+    Returns
+    -------
+    LvAut.recorder.WavRecorder
+        See `rec_file()`.
+
+    See Also
+    --------
+    playrec, rec_file
+
+    """
+    ctx = _CallbackContext()
+    output_frames = ctx.check_data(data, output_mapping, kwargs.get('device'))
+    if dtype is None:
+        dtype = ctx.data.dtype  # ignore module defaults
+    ctx.frames = ctx.check_recorder(filename, output_frames, samplerate,
+                                    channels, dtype, input_mapping, subtype,
+                                    buffer_seconds, kwargs.get('device'))
+
+    def callback(indata, outdata, frames, time, status):
+        assert len(indata) == len(outdata) == frames
+        ctx.callback_enter(status, indata)
+        ctx.push_indata(indata)
+        ctx.write_outdata(outdata)
+        ctx.callback_exit()
+
+    ctx.start_stream(Stream, ctx.samplerate,
+                     (ctx.input_channels, ctx.output_channels),
+                     (ctx.input_dtype, ctx.output_dtype),
+                     callback, blocking,
+                     prime_output_buffers_using_stream_callback=False,
+                     **kwargs)
+    return ctx.recorder
+
+
 def wait(ignore_errors=True):
     """Wait for `play()`/`rec()`/`playrec()` to be finished.
 
@@ -644,6 +773,28 @@ def query_hostapis(index=None):
     }
 
 
+def refresh():
+    """Re-initialize PortAudio to update the list of devices.
+
+    PortAudio only enumerates the devices when it is initialized, so
+    devices plugged in or removed afterwards are not seen by
+    `query_devices()`.  This also clears the cache used to look up
+    devices by name (e.g. ``device='Webcam C930e, DirectSound'``),
+    which is otherwise built on the first lookup and kept.
+
+    All streams must be closed before calling this, because
+    terminating PortAudio invalidates them.  Device IDs may change.
+
+    """
+    global _registry
+    count = _initialized
+    for _ in range(count):
+        _terminate()
+    _registry = None
+    for _ in range(max(count, 1)):
+        _initialize()
+
+
 def check_input_settings(device=None, channels=None, dtype=None,
                          extra_settings=None, samplerate=None):
     """Check if given input device settings are supported.
@@ -759,6 +910,7 @@ class _StreamBase(object):
         """
         assert kind in ('input', 'output', 'duplex')
         assert wrap_callback in ('array', 'buffer', None)
+        self._kind = kind
         if blocksize is None:
             blocksize = default.blocksize
         if clip_off is None:
@@ -824,7 +976,8 @@ class _StreamBase(object):
             @ffi_callback
             def callback_ptr(iptr, optr, frames, time, status, _):
                 data = _buffer(iptr, frames, self._channels, self._samplesize)
-                return _wrap_callback(callback, data, frames, time, status)
+                return _wrap_callback(callback, data, frames, time, status,
+                                      stats=self._stats)
 
         elif kind == 'input' and wrap_callback == 'array':
 
@@ -833,14 +986,16 @@ class _StreamBase(object):
                 data = _array(
                     _buffer(iptr, frames, self._channels, self._samplesize),
                     self._channels, self._dtype)
-                return _wrap_callback(callback, data, frames, time, status)
+                return _wrap_callback(callback, data, frames, time, status,
+                                      stats=self._stats)
 
         elif kind == 'output' and wrap_callback == 'buffer':
 
             @ffi_callback
             def callback_ptr(iptr, optr, frames, time, status, _):
                 data = _buffer(optr, frames, self._channels, self._samplesize)
-                return _wrap_callback(callback, data, frames, time, status)
+                return _wrap_callback(callback, data, frames, time, status,
+                                      stats=self._stats)
 
         elif kind == 'output' and wrap_callback == 'array':
 
@@ -849,7 +1004,8 @@ class _StreamBase(object):
                 data = _array(
                     _buffer(optr, frames, self._channels, self._samplesize),
                     self._channels, self._dtype)
-                return _wrap_callback(callback, data, frames, time, status)
+                return _wrap_callback(callback, data, frames, time, status,
+                                      stats=self._stats)
 
         elif kind == 'duplex' and wrap_callback == 'buffer':
 
@@ -860,7 +1016,8 @@ class _StreamBase(object):
                 idata = _buffer(iptr, frames, ichannels, isize)
                 odata = _buffer(optr, frames, ochannels, osize)
                 return _wrap_callback(
-                    callback, idata, odata, frames, time, status)
+                    callback, idata, odata, frames, time, status,
+                    stats=self._stats)
 
         elif kind == 'duplex' and wrap_callback == 'array':
 
@@ -874,7 +1031,8 @@ class _StreamBase(object):
                 odata = _array(_buffer(optr, frames, ochannels, osize),
                                ochannels, odtype)
                 return _wrap_callback(
-                    callback, idata, odata, frames, time, status)
+                    callback, idata, odata, frames, time, status,
+                    stats=self._stats)
 
         else:
             # Use cast() to allow CData from different FFI instance:
@@ -919,9 +1077,12 @@ class _StreamBase(object):
                     'PaStreamFinishedCallback', finished_callback_wrapper)
             _check(_lib.Pa_SetStreamFinishedCallback(self._ptr,
                                                      self._finished_callback))
+        if default.stats and callback is not None and wrap_callback:
+            self.enable_stats()
 
     # Avoid confusion if something goes wrong before assigning self._ptr:
     _ptr = _ffi.NULL
+    _stats = None
 
     @property
     def samplerate(self):
@@ -1080,6 +1241,83 @@ class _StreamBase(object):
         """
         return _lib.Pa_GetStreamCpuLoad(self._ptr)
 
+    def enable_stats(self, cpu_load_interval=16):
+        """Start collecting callback statistics, see `stats()`.
+
+        This is done for all new streams if `default.stats` is ``True``.
+        Only streams with a Python *callback* are instrumented.
+
+        Parameters
+        ----------
+        cpu_load_interval : int, optional
+            `cpu_load` is sampled every this many callbacks.
+
+        """
+        from .streamstats import StreamStats
+        self._stats = StreamStats(
+            self.samplerate,
+            {'input_underflow': _lib.paInputUnderflow,
+             'input_overflow': _lib.paInputOverflow,
+             'output_underflow': _lib.paOutputUnderflow,
+             'output_overflow': _lib.paOutputOverflow,
+             'priming_output': _lib.paPrimingOutput},
+            cpu_load=lambda: _lib.Pa_GetStreamCpuLoad(self._ptr),
+            cpu_load_interval=cpu_load_interval,
+            input=self._kind != 'output', output=self._kind != 'input')
+
+    def stats(self, reset=False):
+        """Snapshot of the callback statistics.
+
+        The statistics are collected in the audio thread without any
+        locking after `enable_stats()` was called (or if `default.stats`
+        was ``True`` when the stream was created).
+
+        Parameters
+        ----------
+        reset : bool, optional
+            Start counting anew after taking the snapshot, e.g. at the
+            start of each test step.
+
+        Returns
+        -------
+        dict or None
+            ``None`` if statistics are not enabled, otherwise a
+            JSON-serializable dictionary with the keys:
+
+            ``'callbacks'``, ``'duration'``, ``'samplerate'``
+                Number of callbacks, seconds between the first and the
+                last one.
+            ``'callback_time'``
+                Wall time spent in the callback (seconds): ``'count'``,
+                ``'mean'``, ``'min'``, ``'max'``, ``'p50'``, ``'p90'``,
+                ``'p99'``, ``'p99.9'`` and the non-empty buckets of the
+                log-linear ``'histogram'`` as ``[lower_edge, count]``.
+            ``'over_budget'``
+                Callbacks that took longer than their block of audio.
+            ``'block_sizes'``
+                ``{frames: count}``.
+            ``'xruns'``
+                Number of callbacks with each status flag set:
+                ``'input_underflow'``, ``'input_overflow'``,
+                ``'output_underflow'``, ``'output_overflow'``,
+                ``'priming_output'``.
+            ``'input_delay'``, ``'output_delay'``
+                Histograms of ``currentTime - inputBufferAdcTime`` and
+                ``outputBufferDacTime - currentTime`` (seconds), if the
+                host API provides them.
+            ``'cpu_load'``
+                ``'samples'``, ``'mean'``, ``'max'`` and ``'last'`` of
+                `cpu_load`.
+
+        """
+        stats = self._stats
+        if stats is None:
+            return None
+        snapshot = stats.snapshot()
+        if reset:
+            self.enable_stats(stats._cpu_load_interval)
+        return snapshot
+
     def __enter__(self):
         """Start  the stream in the beginning of a "with" statement."""
         self.start()
@@ -1227,6 +1465,37 @@ class RawInputStream(_StreamBase):
             overflowed = False
         return _ffi.buffer(data), overflowed
 
+    def read_into(self, out):
+        """Read samples from the stream into a caller-owned buffer.
+
+        This is the same as `read()`, except that the samples are
+        written into *out* instead of a newly allocated buffer, so a
+        loop reading into the same buffer doesn't allocate any memory
+        for the audio data.
+
+        Parameters
+        ----------
+        out : writable buffer
+            A contiguous buffer (e.g. a `bytearray` or a NumPy array)
+            whose size is a multiple of the frame size; as many frames
+            are read as fit into it.  See also `samplesize`.
+
+        Returns
+        -------
+        overflowed : bool
+            See `Stream.read()`.
+
+        """
+        channels, _ = _split(self._channels)
+        samplesize, _ = _split(self._samplesize)
+        data = _ffi.from_buffer(out, require_writable=True)
+        frames = _frames_in(data, samplesize, channels)
+        err = _lib.Pa_ReadStream(self._ptr, data, frames)
+        if err == _lib.paInputOverflowed:
+            return True
+        _check(err)
+        return False
+
 
 class RawOutputStream(_StreamBase):
     """Raw stream for playback only.  See __init__() and RawStream."""
@@ -1308,12 +1577,7 @@ class RawOutputStream(_StreamBase):
             pass  # input is not a buffer
         _, samplesize = _split(self._samplesize)
         _, channels = _split(self._channels)
-        samples, remainder = divmod(len(data), samplesize)
-        if remainder:
-            raise ValueError('len(data) not divisible by samplesize')
-        frames, remainder = divmod(samples, channels)
-        if remainder:
-            raise ValueError('Number of samples not divisible by channels')
+        frames = _frames_in(data, samplesize, channels)
         err = _lib.Pa_WriteStream(self._ptr, data, frames)
         if err == _lib.paOutputUnderflowed:
             underflowed = True
@@ -1322,6 +1586,35 @@ class RawOutputStream(_StreamBase):
             underflowed = False
         return underflowed
 
+    def write_from(self, buffer):
+        """Write samples from a caller-owned buffer to the stream.
+
+        This is the same as `write()`, except that *buffer* must support
+        the buffer protocol; it is passed to PortAudio without being
+        copied or converted.
+
+        Parameters
+        ----------
+        buffer : buffer
+            A contiguous buffer (e.g. `bytes` or a NumPy array) of
+            interleaved samples, see `write()`.
+
+        Returns
+        -------
+        underflowed : bool
+            See `Stream.write()`.
+
+        """
+        _, samplesize = _split(self._samplesize)
+        _, channels = _split(self._channels)
+        data = _ffi.from_buffer(buffer)
+        frames = _frames_in(data, samplesize, channels)
+        err = _lib.Pa_WriteStream(self._ptr, data, frames)
+        if err == _lib.paOutputUnderflowed:
+            return True
+        _check(err)
+        return False
+
 
 class RawStream(RawInputStream, RawOutputStream):
     """Raw stream for playback and recording.  See __init__()."""
@@ -1447,6 +1740,31 @@ class InputStream(RawInputStream):
         data = _array(data, channels, dtype)
         return data, overflowed
 
+    def read_into(self, out):
+        """Read samples from the stream into an existing NumPy array.
+
+        This is the same as `read()`, except that ``len(out)`` frames
+        are written into *out*, so reading repeatedly into the same
+        array doesn't allocate any memory.
+
+        Parameters
+        ----------
+        out : numpy.ndarray
+            A C-contiguous, writable array with a data type specified by
+            `dtype` and one column per channel (a one-dimensional array
+            can be used for mono data).
+
+        Returns
+        -------
+        overflowed : bool
+            See `read()`.
+
+        """
+        dtype, _ = _split(self._dtype)
+        channels, _ = _split(self._channels)
+        _check_array(out, channels, dtype)
+        return RawInputStream.read_into(self, out)
+
 
 class OutputStream(RawOutputStream):
     """Stream for output only.  See __init__() and Stream."""
@@ -1520,15 +1838,27 @@ class OutputStream(RawOutputStream):
         data = np.asarray(data)
         _, dtype = _split(self._dtype)
         _, channels = _split(self._channels)
-        if data.ndim > 1 and data.shape[1] != channels:
-            raise ValueError('Number of channels must match')
-        if data.dtype != dtype:
-            raise TypeError('dtype mismatch: {!r} vs {!r}'.format(
-                data.dtype.name, dtype))
-        if not data.flags.c_contiguous:
-            raise TypeError('data must be C-contiguous')
+        _check_array(data, channels, dtype)
         return RawOutputStream.write(self, data)
 
+    def write_from(self, buffer):
+        """Write samples from an existing NumPy array to the stream.
+
+        This is the same as `write()`, except that *buffer* must already
+        be a `numpy.ndarray` with the right `dtype` and number of
+        channels; it is passed to PortAudio without any conversion.
+
+        Returns
+        -------
+        underflowed : bool
+            See `write()`.
+
+        """
+        _, dtype = _split(self._dtype)
+        _, channels = _split(self._channels)
+        _check_array(buffer, channels, dtype)
+        return RawOutputStream.write_from(self, buffer)
+
 
 class Stream(InputStream, OutputStream):
     """Stream for input and output.  See __init__()."""
@@ -1773,6 +2103,332 @@ class Stream(InputStream, OutputStream):
                              **_remove_self(locals()))
 
 
+class Session(object):
+    """Persistent duplex stream for repeated stimulus/capture cycles.
+
+    `play()`, `rec()` and `playrec()` open a new stream for every call,
+    which costs the device open latency on each test step.  A `Session`
+    opens one `Stream` and keeps it running; stimuli are queued and
+    played back-to-back, and each request returns the input captured
+    while its stimulus was played, sample-aligned to it.
+
+    Example::
+
+        with sd.Session(samplerate=48000, channels=(2, 1)) as session:
+            for stimulus in steps:
+                response = session.playrec(stimulus)
+
+    """
+
+    def __init__(self, samplerate=None, blocksize=None, device=None,
+                 channels=None, dtype='float32', latency=None,
+                 extra_settings=None, compensate_latency=True,
+                 max_delay=0.5, **kwargs):
+        """Open and start the duplex stream.
+
+        Parameters
+        ----------
+        samplerate, blocksize, device, channels, dtype, latency, extra_settings
+            See `Stream`.  *dtype* is used for input and output.
+        compensate_latency : bool, optional
+            If ``True`` (the default), captures start at the input sample
+            taken when the first stimulus sample reaches the DAC, as
+            reported by the host API (``outputBufferDacTime -
+            inputBufferAdcTime``).  If ``False``, input and output are
+            aligned per callback block.
+        max_delay : float, optional
+            Largest round-trip delay in seconds searched by `align()`;
+            ``playrec(..., align=True)`` records this much longer than
+            the stimulus.
+        **kwargs
+            Further parameters of `Stream` -- except *callback* and
+            *finished_callback*.
+
+        """
+        import collections
+        self._queue = collections.deque()
+        self._playing = None
+        self._capturing = []
+        self._position = 0
+        self._pool = {}
+        self._lent = []
+        self._delays = {}
+        self.compensate_latency = compensate_latency
+        self.max_delay = max_delay
+        self.status = CallbackFlags()
+        self.stream = Stream(samplerate=samplerate, blocksize=blocksize,
+                             device=device, channels=channels, dtype=dtype,
+                             latency=latency, extra_settings=extra_settings,
+                             callback=self._callback,
+                             prime_output_buffers_using_stream_callback=False,
+                             **kwargs)
+        self.stream.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def samplerate(self):
+        return self.stream.samplerate
+
+    @property
+    def pending(self):
+        """Number of requests not finished yet."""
+        return len(self._queue) + len(self._capturing)
+
+    def _buffer(self, shape, dtype):
+        free = self._pool.get((shape, dtype))
+        if free:
+            return free.pop()
+        import numpy as np
+        return np.empty(shape, dtype=dtype)
+
+    def _release(self, request):
+        if request.pooled:
+            key = (request.out.shape, request.out.dtype.str)
+            self._pool.setdefault(key, []).append(request.out)
+            request.pooled = False
+
+    def submit(self, stimulus, capture=True, input_mapping=None,
+               output_mapping=None, extra_frames=0, out=None):
+        """Queue *stimulus* for playback and return a `SessionRequest`.
+
+        Parameters
+        ----------
+        stimulus : array_like
+            ``(frames, channels)`` or ``(frames,)`` data of the session
+            *dtype*; mono data is copied to all mapped channels.  It is
+            played right after the previously queued stimulus and must
+            not be modified until the request is done.
+        capture : bool, optional
+            Also record while the stimulus is played.
+        input_mapping, output_mapping : array_like, optional
+            Channel numbers (starting with 1) to record and to play,
+            see `playrec()`.
+        extra_frames : int, optional
+            Keep recording this many frames after the end of the
+            stimulus, e.g. to capture a decay.
+        out : numpy.ndarray, optional
+            Array to record into, of shape ``(frames + extra_frames,
+            input channels)``.  By default a buffer from the session's
+            pool is used.
+
+        """
+        import numpy as np
+        if self.stream.closed:
+            raise PortAudioError('Session is closed')
+        in_channels, out_channels = self.stream.channels
+        in_dtype, out_dtype = self.stream.dtype
+        stimulus = np.asarray(stimulus, dtype=out_dtype)
+        if stimulus.ndim < 2:
+            stimulus = stimulus.reshape(-1, 1)
+        output_mapping, _ = _check_mapping(output_mapping, out_channels)
+        if stimulus.shape[1] not in (1, len(output_mapping)):
+            raise ValueError(
+                'number of output channels != size of output mapping')
+        if output_mapping.max() >= out_channels:
+            raise ValueError('output mapping exceeds the stream channels')
+
+        request = SessionRequest(self, stimulus, output_mapping)
+        if capture:
+            input_mapping, _ = _check_mapping(input_mapping, in_channels)
+            if input_mapping.max() >= in_channels:
+                raise ValueError('input mapping exceeds the stream channels')
+            shape = (len(stimulus) + int(extra_frames), len(input_mapping))
+            if out is None:
+                out = self._buffer(shape, np.dtype(in_dtype).str)
+                request.pooled = True
+            elif out.shape != shape:
+                raise ValueError('out must have shape {}'.format(shape))
+            request.out = out
+            request.input_mapping = input_mapping
+            request.input_identity = np.array_equal(
+                input_mapping, np.arange(in_channels))
+        self._queue.append(request)
+        return request
+
+    def align(self, stimulus, response, input_mapping=None,
+              output_mapping=None, refresh=False):
+        """Return the delay of *response* behind *stimulus* in frames.
+
+        The delay is estimated with `LvAut.thd.align` from the first
+        channel of each and cached per device and channel mapping, so
+        only the first call of a test setup pays for the correlation.
+
+        Parameters
+        ----------
+        stimulus, response : array_like
+            ``(frames, channels)`` or ``(frames,)`` data as passed to and
+            returned by `playrec()`.
+        input_mapping, output_mapping : array_like, optional
+            The mappings of the capture, used as part of the cache key.
+        refresh : bool, optional
+            Estimate the delay again even if it is cached, e.g. after
+            the DUT was changed.
+
+        Returns
+        -------
+        float
+            Fractional delay in frames.
+
+        """
+        import numpy as np
+        key = (self.stream.device,
+               None if input_mapping is None else
+               tuple(np.atleast_1d(input_mapping).tolist()),
+               None if output_mapping is None else
+               tuple(np.atleast_1d(output_mapping).tolist()))
+        if refresh or key not in self._delays:
+            from .thd import align
+            stimulus = np.asarray(stimulus)
+            response = np.asarray(response)
+            if stimulus.ndim > 1:
+                stimulus = stimulus[:, 0]
+            if response.ndim > 1:
+                response = response[:, 0]
+            delay, _ = align(stimulus, response, max_delay=int(
+                self.max_delay * self.stream.samplerate))
+            self._delays[key] = delay
+        return self._delays[key]
+
+    def playrec(self, stimulus, copy=False, timeout=None, align=False,
+                **kwargs):
+        """Play *stimulus*, wait and return the sample-aligned capture.
+
+        With ``copy=False`` (the default) the returned array is a session
+        buffer which is reused by the next `playrec()` call, so repeated
+        test steps do not allocate.  Use ``copy=True`` to keep it.
+        With ``align=True`` the capture is *max_delay* seconds longer and
+        is cropped at the (cached) delay of the DUT found by `align()`,
+        so it has the length of the stimulus and starts with its
+        response.  Further arguments are passed to `submit()`.
+
+        """
+        for request in self._lent:
+            self._release(request)
+        del self._lent[:]
+        if align:
+            kwargs.setdefault('extra_frames',
+                              int(self.max_delay * self.stream.samplerate))
+        request = self.submit(stimulus, **kwargs)
+        data = request.result(timeout)
+        if align:
+            start = int(round(self.align(
+                request.stimulus, data, kwargs.get('input_mapping'),
+                kwargs.get('output_mapping'))))
+            data = data[start:start + len(request.stimulus)]
+        if copy:
+            data = data.copy()
+            self._release(request)
+        else:
+            self._lent.append(request)
+        return data
+
+    def play(self, stimulus, timeout=None, **kwargs):
+        """Play *stimulus* without recording and wait until done."""
+        self.submit(stimulus, capture=False, **kwargs).result(timeout)
+
+    def _callback(self, indata, outdata, frames, time, status):
+        self.status |= status
+        position = self._position
+        outdata.fill(0)
+        offset = 0
+        while offset < frames:
+            request = self._playing
+            if request is None:
+                if not self._queue:
+                    break
+                request = self._playing = self._queue.popleft()
+                shift = 0
+                if self.compensate_latency:
+                    shift = int(round((time.outputBufferDacTime -
+                                       time.inputBufferAdcTime) *
+                                      self.stream.samplerate))
+                request.start = position + offset + max(shift, 0)
+                if request.out is not None:
+                    self._capturing.append(request)
+            n = min(frames - offset, len(request.stimulus) - request.played)
+            outdata[offset:offset + n, request.output_mapping] = \
+                request.stimulus[request.played:request.played + n]
+            request.played += n
+            offset += n
+            if request.played == len(request.stimulus):
+                self._playing = None
+                if request.out is None:
+                    request.event.set()
+
+        end = position + frames
+        for request in self._capturing:
+            first = max(request.start, position)
+            last = min(request.start + len(request.out), end)
+            if last > first:
+                target = request.out[first - request.start:
+                                     last - request.start]
+                source = indata[first - position:last - position]
+                if request.input_identity:
+                    target[:] = source
+                else:
+                    target[:] = source[:, request.input_mapping]
+            if request.start + len(request.out) <= end:
+                request.event.set()
+        if self._capturing:
+            self._capturing = [request for request in self._capturing
+                               if not request.event.is_set()]
+        self._position = end
+
+    def close(self, ignore_errors=True):
+        """Stop the stream; pending requests fail."""
+        self.stream.stop(ignore_errors)
+        self.stream.close(ignore_errors)
+        pending = list(self._queue) + self._capturing
+        if self._playing is not None and self._playing not in pending:
+            pending.append(self._playing)
+        for request in pending:
+            request.error = PortAudioError('Session closed')
+            request.event.set()
+        self._queue.clear()
+        self._capturing = []
+        self._playing = None
+
+
+class SessionRequest(object):
+    """A queued stimulus/capture of a `Session`.  See `Session.submit()`."""
+
+    out = None
+    input_mapping = None
+    input_identity = False
+    pooled = False
+    error = None
+    start = None
+
+    def __init__(self, session, stimulus, output_mapping):
+        import threading
+        self._session = session
+        self.stimulus = stimulus
+        self.output_mapping = output_mapping
+        self.played = 0
+        self.event = threading.Event()
+
+    @property
+    def done(self):
+        return self.event.is_set()
+
+    def result(self, timeout=None):
+        """Wait until done; return the capture (or ``None`` without)."""
+        if not self.event.wait(timeout):
+            raise TimeoutError('Session request not finished')
+        if self.error is not None:
+            raise self.error
+        return self.out
+
+    def release(self):
+        """Return the capture buffer to the session pool for reuse."""
+        self._session._release(self)
+
+
 class DeviceList(tuple):
     """A list with information about all available audio devices.
 
@@ -2153,6 +2809,22 @@ class default(object):
     (i.e. if *callback* wasn't specified).  See also
     http://www.portaudio.com/docs/proposals/020-AllowCallbackToPrimeStream.html.
 
+    """
+    stats = False
+    """Collect callback statistics for new streams.
+
+    Set to ``True`` to call :meth:`~Stream.enable_stats` for every new
+    stream with a Python callback, including the ones created by
+    `play()`, `rec()` and `playrec()`.  See :meth:`~Stream.stats`.
+
+    """
+    stats_file = None
+    """Append the statistics to this file after `wait()`.
+
+    If set (and `default.stats` is ``True``), one JSON object per line is
+    appended after each `wait()`, containing the :meth:`~Stream.stats`
+    snapshot of the finished stream and its ``'status'``.
+
     """
 
     def __init__(self):
@@ -2432,7 +3104,13 @@ class WasapiSettings(object):
 
 
 class _CallbackContext(object):
-    """Helper class for re-use in play()/rec()/playrec() callbacks."""
+    """Helper class for re-use in play()/rec()/playrec() callbacks.
+
+    The wall time spent between `callback_enter()` and `callback_exit()`
+    is accumulated in *callback_count*, *callback_time* and
+    *callback_max* (in seconds).
+
+    """
 
     blocksize = None
     data = None
@@ -2441,7 +3119,15 @@ class _CallbackContext(object):
     input_channels = output_channels = None
     input_dtype = output_dtype = None
     input_mapping = output_mapping = None
+    input_runs = output_runs = silent_runs = ()
     silent_channels = None
+    recorder = None
+    samplerate = None
+    callback_count = 0
+    callback_time = callback_max = 0.0
+    # data played with loop=True is tiled to at least this many frames,
+    # so that it wraps around at most once per block
+    loop_frames = 8192
 
     def __init__(self, loop=False):
         import threading
@@ -2481,11 +3167,21 @@ class _CallbackContext(object):
         if len(mapping) + len(silent_channels) != channels:
             raise ValueError('each channel may only appear once in mapping')
 
+        if self.loop and 0 < frames < self.loop_frames:
+            data = np.tile(data, (-(-self.loop_frames // frames), 1))
+            frames = len(data)
+
         self.data = data
         self.output_channels = channels
         self.output_dtype = dtype
         self.output_mapping = mapping
         self.silent_channels = silent_channels
+        self.output_runs = _mapping_runs(mapping)
+        if data.shape[1] == 1:
+            # mono data is broadcast to all runs of output channels
+            self.output_runs = [(slice(0, 1), channels)
+                                for _, channels in self.output_runs]
+        self.silent_runs = _mapping_runs(silent_channels)
         return frames
 
     def check_out(self, out, frames, channels, dtype, mapping):
@@ -2518,43 +3214,96 @@ class _CallbackContext(object):
         self.input_channels = channels
         self.input_dtype = dtype
         self.input_mapping = mapping
+        self.input_runs = _mapping_runs(mapping)
         return out, frames
 
+    def check_recorder(self, filename, frames, samplerate, channels, dtype,
+                       mapping, subtype, buffer_seconds, device):
+        """Check input settings and start a WAV file recorder."""
+        import numpy as np
+        from .recorder import WavRecorder
+        if channels is None:
+            channels = default.channels['input']
+        if channels is None:
+            if mapping is None:
+                raise TypeError('Unable to determine number of input channels')
+            channels = len(np.atleast_1d(mapping))
+        if dtype is None:
+            dtype = default.dtype['input']
+        dtype = _check_dtype(dtype)
+        mapping, channels = _check_mapping(mapping, channels)
+        if samplerate is None:
+            samplerate = default.samplerate
+        if samplerate is None:
+            samplerate = query_devices(device, 'input')['default_samplerate']
+
+        self.input_channels = channels
+        self.input_dtype = dtype
+        self.input_mapping = mapping
+        # a plain slice of indata can be pushed without a copy
+        self.input_identity = np.array_equal(mapping, np.arange(channels))
+        self.samplerate = samplerate
+        self.recorder = WavRecorder(filename, samplerate, len(mapping),
+                                    dtype=dtype, subtype=subtype,
+                                    buffer_seconds=buffer_seconds)
+        return _sys.maxsize if frames is None else frames
+
+    def push_indata(self, indata):
+        if self.input_identity:
+            self.recorder.push(indata[:self.blocksize])
+        else:
+            self.recorder.push(indata[:self.blocksize, self.input_mapping])
+
     def callback_enter(self, status, data):
         """Check status and blocksize."""
+        self._enter_time = _time.perf_counter()
         self.status |= status
         self.blocksize = min(self.frames - self.frame, len(data))
 
     def read_indata(self, indata):
-        # We manually iterate over each channel in mapping because
-        # numpy.take(..., out=...) has a bug:
+        # We copy slices of consecutive channels (a single slice for the
+        # default mapping) because numpy.take(..., out=...) has a bug:
         # https://github.com/numpy/numpy/pull/4246.
         # Note: using indata[:blocksize, mapping] (a.k.a. 'fancy' indexing)
-        # would create unwanted copies (and probably memory allocations).
-        for target, source in enumerate(self.input_mapping):
+        # creates a temporary copy, which is still cheaper than a copy per
+        # run for scattered mappings (see _mapping_runs()).
+        out = self.out[self.frame:self.frame + self.blocksize]
+        indata = indata[:self.blocksize]
+        for columns, channels in self.input_runs:
             # If out.dtype is 'float64', 'float32' data is "upgraded" here:
-            self.out[self.frame:self.frame + self.blocksize, target] = \
-                indata[:self.blocksize, source]
+            out[:, columns] = indata[:, channels]
+
+    def _write_block(self, outdata):
+        data = self.data[self.frame:self.frame + self.blocksize]
+        outdata = outdata[:self.blocksize]
+        for columns, channels in self.output_runs:
+            # 'float64' data is cast to 'float32' here:
+            outdata[:, channels] = data[:, columns]
+        for _, channels in self.silent_runs:
+            outdata[:, channels] = 0
 
     def write_outdata(self, outdata):
-        # 'float64' data is cast to 'float32' here:
-        outdata[:self.blocksize, self.output_mapping] = \
-            self.data[self.frame:self.frame + self.blocksize]
-        outdata[:self.blocksize, self.silent_channels] = 0
-        if self.loop and self.blocksize < len(outdata):
+        self._write_block(outdata)
+        offset = self.blocksize
+        while self.loop and self.frames and offset < len(outdata):
             self.frame = 0
-            outdata = outdata[self.blocksize:]
-            self.blocksize = min(self.frames, len(outdata))
-            self.write_outdata(outdata)
-        else:
-            outdata[self.blocksize:] = 0
+            self.blocksize = min(self.frames, len(outdata) - offset)
+            self._write_block(outdata[offset:])
+            offset += self.blocksize
+        outdata[offset:] = 0
 
     def callback_exit(self):
+        elapsed = _time.perf_counter() - self._enter_time
+        self.callback_count += 1
+        self.callback_time += elapsed
+        self.callback_max = max(self.callback_max, elapsed)
         if not self.blocksize:
             raise CallbackAbort
         self.frame += self.blocksize
 
     def finished_callback(self):
+        if self.recorder is not None:
+            self.recorder.finish()
         self.event.set()
         # Drop temporary audio buffers to free memory
         self.data = None
@@ -2566,13 +3315,23 @@ class _CallbackContext(object):
     def start_stream(self, StreamClass, samplerate, channels, dtype, callback,
                      blocking, **kwargs):
         stop()  # Stop previous playback/recording
-        self.stream = StreamClass(samplerate=samplerate,
-                                  channels=channels,
-                                  dtype=dtype,
-                                  callback=callback,
-                                  finished_callback=self.finished_callback,
-                                  **kwargs)
-        self.stream.start()
+        try:
+            self.stream = StreamClass(samplerate=samplerate,
+                                      channels=channels,
+                                      dtype=dtype,
+                                      callback=callback,
+                                      finished_callback=self.finished_callback,
+                                      **kwargs)
+            self.stream.start()
+        except BaseException:
+            if self.recorder is not None:
+                # Nothing was recorded: stop the writer thread, drop the file
+                self.recorder.close()
+                try:
+                    _os.remove(self.recorder.path)
+                except OSError:
+                    pass
+            raise
         global _last_callback
         _last_callback = self
         if blocking:
@@ -2588,8 +3347,31 @@ class _CallbackContext(object):
             self.event.wait()
         finally:
             self.stream.close(ignore_errors)
+            if self.recorder is not None:
+                self.recorder.close()
+        if default.stats_file is not None:
+            self.dump_stats(default.stats_file)
         return self.status if self.status else None
 
+    def dump_stats(self, filename):
+        """Append the stream statistics as one line of JSON."""
+        import json
+        stats = self.stream.stats()
+        if stats is None:
+            return
+        stats['status'] = str(self.status)
+        with open(filename, 'a') as f:
+            f.write(json.dumps(stats) + '\n')
+
+
+def __getattr__(name):
+    # LvAut.device.aio is imported on first use (it imports this module)
+    if name == 'aio':
+        from . import aio
+        return aio
+    raise AttributeError('module {!r} has no attribute {!r}'.format(
+        __name__, name))
+
 
 def _remove_self(d):
     """Return a copy of d without the 'self' entry."""
@@ -2613,6 +3395,29 @@ def _check_mapping(mapping, channels):
     return mapping, channels
 
 
+def _mapping_runs(mapping, max_runs=2):
+    """Split a channel mapping into runs of consecutive channels.
+
+    Returns a list of ``(columns, channels)`` pairs, such that
+    ``data[:, columns]`` belongs to the channels ``channels``; the
+    default mapping is a single pair of slices.  A mapping with more
+    than *max_runs* runs is a single pair of all columns and the mapping
+    itself, because one fancy-indexed copy is faster than a Python-level
+    copy per run.
+
+    """
+    runs = []
+    start = 0
+    for i in range(1, len(mapping) + 1):
+        if i == len(mapping) or mapping[i] != mapping[i - 1] + 1:
+            first, last = int(mapping[start]), int(mapping[i - 1])
+            runs.append((slice(start, i), slice(first, last + 1)))
+            start = i
+    if len(runs) > max_runs:
+        return [(slice(None), mapping)]
+    return runs
+
+
 def _check_dtype(dtype):
     """Check dtype."""
     import numpy as np
@@ -2667,15 +3472,23 @@ def _get_stream_parameters(kind, device, channels, dtype, latency,
     return parameters, dtype, samplesize, samplerate
 
 
-def _wrap_callback(callback, *args):
+def _wrap_callback(callback, *args, stats=None):
     """Invoke callback function and check for custom exceptions."""
-    args = args[:-1] + (CallbackFlags(args[-1]),)
+    if stats is not None:
+        start = _time.perf_counter()
+    flags = args[-1]
+    args = args[:-1] + (CallbackFlags(flags),)
     try:
         callback(*args)
     except CallbackStop:
         return _lib.paComplete
     except CallbackAbort:
         return _lib.paAbort
+    finally:
+        if stats is not None:
+            # args: ..., frames, time, status
+            stats.record(_time.perf_counter() - start, args[-3], args[-2],
+                         flags)
     return _lib.paContinue
 
 
@@ -2692,6 +3505,28 @@ def _array(buffer, channels, dtype):
     return data
 
 
+def _check_array(data, channels, dtype):
+    """Check a NumPy array passed to `Stream.write()` and friends."""
+    if data.ndim > 1 and data.shape[1] != channels:
+        raise ValueError('Number of channels must match')
+    if data.dtype != dtype:
+        raise TypeError('dtype mismatch: {!r} vs {!r}'.format(
+            data.dtype.name, dtype))
+    if not data.flags.c_contiguous:
+        raise TypeError('data must be C-contiguous')
+
+
+def _frames_in(data, samplesize, channels):
+    """Number of frames in a buffer of interleaved samples."""
+    samples, remainder = divmod(len(data), samplesize)
+    if remainder:
+        raise ValueError('len(data) not divisible by samplesize')
+    frames, remainder = divmod(samples, channels)
+    if remainder:
+        raise ValueError('Number of samples not divisible by channels')
+    return frames
+
+
 def _split(value):
     """Split input/output value into two values.
 
@@ -2755,49 +3590,88 @@ def _get_device_id(id_or_query_string, kind, raise_on_error=False):
 
     if isinstance(id_or_query_string, int):
         return id_or_query_string
-    device_list = []
-    for id, info in enumerate(query_devices()):
-        if not kind or info['max_' + kind + '_channels'] > 0:
-            hostapi_info = query_hostapis(info['hostapi'])
-            device_list.append((id, info['name'], hostapi_info['name']))
-
-    query_string = id_or_query_string.lower()
-    substrings = query_string.split()
-    matches = []
-    exact_device_matches = []
-    for id, device_string, hostapi_string in device_list:
-        full_string = device_string + ', ' + hostapi_string
-        pos = 0
-        for substring in substrings:
-            pos = full_string.lower().find(substring, pos)
-            if pos < 0:
-                break
-            pos += len(substring)
-        else:
-            matches.append((id, full_string))
-            if device_string.lower() == query_string:
-                exact_device_matches.append(id)
+    device, matches = _device_registry().find(id_or_query_string, kind)
+    if device >= 0 or not raise_on_error:
+        return device
 
     if kind is None:
         kind = 'input/output'  # Just used for error messages
-
     if not matches:
-        if raise_on_error:
-            raise ValueError(
-                'No ' + kind + ' device matching ' + repr(id_or_query_string))
-        else:
-            return -1
-    if len(matches) > 1:
+        raise ValueError(
+            'No ' + kind + ' device matching ' + repr(id_or_query_string))
+    raise ValueError('Multiple ' + kind + ' devices found for ' +
+                     repr(id_or_query_string) + ':\n' +
+                     '\n'.join('[{}] {}'.format(id, name)
+                                for id, name in matches))
+
+
+class _DeviceRegistry(object):
+    """Device names and host API names, queried once.
+
+    Name lookups are resolved against precomputed lower-case strings and
+    memoized per (query, kind), so repeated lookups of the same device
+    are a dict hit.  Call `refresh()` to pick up added or removed
+    devices.
+
+    """
+
+    def __init__(self):
+        hostapi_names = [hostapi['name'] for hostapi in query_hostapis()]
+        self.devices = []
+        for id, info in enumerate(query_devices()):
+            full_string = info['name'] + ', ' + hostapi_names[info['hostapi']]
+            self.devices.append((id, info, full_string,
+                                 full_string.lower(),
+                                 ' '.join(info['name'].lower().split())))
+        self._lookup = {}
+
+    def find(self, query_string, kind):
+        """Return ``(device, matches)`` for space-separated substrings.
+
+        *device* is -1 if there is no unique match; *matches* is the list
+        of ``(id, 'name, host API')`` pairs that contain the substrings.
+
+        """
+        query_string = ' '.join(query_string.lower().split())
+        try:
+            return self._lookup[query_string, kind]
+        except KeyError:
+            pass
+        result = self._lookup[query_string, kind] = self._match(
+            query_string, kind)
+        return result
+
+    def _match(self, query_string, kind):
+        substrings = query_string.split()
+        matches = []
+        exact_device_matches = []
+        for id, info, full_string, full_lower, name_lower in self.devices:
+            if kind and info['max_' + kind + '_channels'] < 1:
+                continue
+            pos = 0
+            for substring in substrings:
+                pos = full_lower.find(substring, pos)
+                if pos < 0:
+                    break
+                pos += len(substring)
+            else:
+                matches.append((id, full_string))
+                if name_lower == query_string:
+                    exact_device_matches.append(id)
+
+        if len(matches) == 1:
+            return matches[0][0], matches
         if len(exact_device_matches) == 1:
-            return exact_device_matches[0]
-        if raise_on_error:
-            raise ValueError('Multiple ' + kind + ' devices found for ' +
-                             repr(id_or_query_string) + ':\n' +
-                             '\n'.join('[{}] {}'.format(id, name)
-                                       for id, name in matches))
-        else:
-            return -1
-    return matches[0][0]
+            return exact_device_matches[0], matches
+        return -1, matches
+
+
+def _device_registry():
+    global _registry
+    registry = _registry
+    if registry is None:
+        registry = _registry = _DeviceRegistry()
+    return registry
 
 
 def _initialize():
@@ -2856,6 +3730,9 @@ def _exit_handler():
         # calling close()
         _last_callback.stream.stop()
         _last_callback.stream.close()
+        if _last_callback.recorder is not None:
+            # let the writer thread finish the file
+            _last_callback.recorder.close()
 
     while _initialized:
         _terminate()
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+'''Limit lines and vectorized pass/fail checks
+   lorry rui , Newark , USA
+
+A limit line is a list of ``(frequency, value)`` breakpoints, linear in
+value over log frequency.  It is compiled once per frequency grid into an
+array (cached), and a whole curve - or a 2D batch of units with shape
+``(units, points)`` - is checked with NumPy masks::
+
+    import LvAut.limits as lim
+    thd_limit = lim.LimitMask(upper=[(200, 10), (1000, 3), (10000, 3)])
+    res = thd_limit.check(Freq_THD, thd_data)
+    res.passed, res.margin, res.worst_freq
+
+Points outside the frequency span of a limit line are not checked.
+'''
+
+import collections
+import functools
+
+import numpy as np
+
+from .lvspectrum import ParameterError
+
+
+__all__ = ['LimitLine', 'LimitMask', 'LimitResult', 'range_limit',
+           'check_curves']
+
+# number of (limit line, frequency grid) pairs kept compiled
+LIMIT_CACHE_SIZE = 64
+
+
+LimitResult = collections.namedtuple(
+    'LimitResult', ['passed', 'margin', 'worst', 'worst_freq', 'fail'])
+LimitResult.__doc__ = '''Outcome of `LimitMask.check`.
+
+*passed*, *margin* (smallest distance to a limit, negative when outside),
+*worst* (index of the point with that margin) and *worst_freq* have the
+leading shape of the checked data, i.e. one value per unit; *fail* is the
+per-point mask of the same shape as the data.
+'''
+
+
+@functools.lru_cache(maxsize=LIMIT_CACHE_SIZE)
+def _compile(points, grid, dtype, shape):
+    freqs = np.frombuffer(grid, dtype=dtype).reshape(shape)
+    bp_freq, bp_value = np.array(points, dtype=np.float64).T
+    with np.errstate(divide='ignore'):
+        line = np.interp(np.log10(freqs), np.log10(bp_freq), bp_value,
+                         left=np.nan, right=np.nan)
+    # shared between callers
+    line.flags.writeable = False
+    return line
+
+
+class LimitLine(object):
+    '''Piecewise log-frequency limit line.
+
+    :param points: ``(frequency, value)`` breakpoints; frequencies must be
+        positive and increasing.  A value may repeat at one frequency to
+        make a step.
+    '''
+
+    def __init__(self, points):
+        points = tuple((float(f), float(v)) for f, v in points)
+        if len(points) < 2:
+            raise ParameterError('A limit line needs at least 2 points')
+        freqs = np.array([f for f, _ in points])
+        if np.any(freqs <= 0) or np.any(np.diff(freqs) < 0):
+            raise ParameterError('Limit frequencies must be positive and '
+                                 'increasing: {}'.format(points))
+        self.points = points
+
+    def __repr__(self):
+        return 'LimitLine({!r})'.format(list(self.points))
+
+    def on_grid(self, freqs):
+        '''The limit interpolated onto *freqs* (NaN outside the line).
+
+        Compiled arrays are cached per frequency grid, so checking many
+        captures on the same grid only interpolates once.  The result is
+        read-only.
+        '''
+        freqs = np.ascontiguousarray(freqs, dtype=np.float64)
+        return _compile(self.points, freqs.tobytes(), freqs.dtype.str,
+                        freqs.shape)
+
+
+def _line(points):
+    if points is None or isinstance(points, LimitLine):
+        return points
+    return LimitLine(points)
+
+
+class LimitMask(object):
+    '''Upper and/or lower `LimitLine` for one measurement curve.'''
+
+    def __init__(self, upper=None, lower=None):
+        if upper is None and lower is None:
+            raise ParameterError('Need an upper or a lower limit')
+        self.upper = _line(upper)
+        self.lower = _line(lower)
+
+    def __repr__(self):
+        return 'LimitMask(upper={!r}, lower={!r})'.format(self.upper,
+                                                          self.lower)
+
+    def margin(self, freqs, data):
+        '''Per-point distance to the nearest limit (negative outside,
+        NaN where no limit applies).'''
+        data = np.asarray(data, dtype=np.float64)
+        margins = []
+        if self.upper is not None:
+            margins.append(self.upper.on_grid(freqs) - data)
+        if self.lower is not None:
+            margins.append(data - self.lower.on_grid(freqs))
+        # fmin ignores a NaN from a line that does not cover the point
+        return functools.reduce(np.fmin, margins)
+
+    def check(self, freqs, data):
+        '''Check *data* (``(points,)`` or ``(units, points)``) measured at
+        *freqs* (``(points,)`` or the shape of *data*) against the limits.
+
+        :return: `LimitResult`
+        '''
+        data = np.asarray(data, dtype=np.float64)
+        if data.shape[-1] == 0:
+            raise ParameterError('No data points to check')
+        margin = self.margin(freqs, data)
+        checked = ~np.isnan(margin)
+        fail = checked & (margin < 0)
+
+        worst = np.argmin(np.where(checked, margin, np.inf), axis=-1)
+        worst_margin = np.take_along_axis(margin, worst[..., np.newaxis],
+                                          axis=-1)[..., 0]
+        freqs = np.broadcast_to(freqs, margin.shape)
+        worst_freq = np.take_along_axis(freqs, worst[..., np.newaxis],
+                                        axis=-1)[..., 0]
+        return LimitResult(passed=~np.any(fail, axis=-1),
+                           margin=worst_margin, worst=worst,
+                           worst_freq=worst_freq, fail=fail)
+
+
+def range_limit(start_Freq, end_Freq, lowlimit=None, uplimit=None):
+    '''Flat limits between *start_Freq* and *end_Freq*, as used by
+    ``checkdata`` of ``wav_file_test_sample.py``.'''
+    def flat(value):
+        if value is None:
+            return None
+        return [(start_Freq, value), (end_Freq, value)]
+    return LimitMask(upper=flat(uplimit), lower=flat(lowlimit))
+
+
+def check_curves(curves, masks):
+    '''Check several curves at once.
+
+    :param curves: ``{name: (freqs, data)}``, e.g. ``'thd'``,
+        ``'power'``, ``'rub_buzz'``
+    :param masks: ``{name: LimitMask}``; curves without a mask are skipped
+    :return: ``passed, {name: LimitResult}``; *passed* is True where all
+        checked curves pass (per unit for batched data)
+    '''
+    results = {name: masks[name].check(*curves[name])
+               for name in curves if name in masks}
+    passed = np.logical_and.reduce([res.passed
+                                    for res in results.values()] or [True])
+    return passed, results
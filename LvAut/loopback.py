@@ -0,0 +1,619 @@
+# -*- coding: utf-8 -*-
+'''Software loopback audio backend with a DUT simulator
+   lorry rui , Newark , USA
+
+An in-process replacement of the PortAudio library for `LvAut.device`,
+so the station pipeline (play/rec/playrec, streams, `Session`, analysis)
+runs without audio hardware, e.g. on CI machines.  It is selected with
+an environment variable before `LvAut.device` is imported::
+
+    LVAUT_AUDIO_BACKEND=loopback LVAUT_LOOPBACK_CLOCK=free python station.py
+
+and configured from Python::
+
+    import LvAut.loopback as lb
+    lb.configure(dut=lb.DUTModel(delay=0.003, gain=-6,
+                                 response=[(20, -12), (100, 0), (20000, -3)],
+                                 harmonics={2: 0.01, 3: 0.003},
+                                 noise=-90, buzz_rate=0.5))
+    import LvAut.device as sd
+    y = sd.playrec(x, samplerate=48000, channels=1, blocking=True)
+
+The virtual device is a duplex device: the output of each callback block
+goes through the `DUTModel` and is the input of the next block, i.e. the
+loop latency is one block plus the DUT delay (reported consistently in
+the callback time stamps).  Input channel *i* receives output channel
+``i % output_channels``; an input-only stream records the DUT's noise.
+With ``clock='realtime'`` the callbacks are paced by the sample rate
+(late callbacks are flagged as input overflow/output underflow), with
+``clock='free'`` they run as fast as possible.
+
+Any other module exposing ``Library(ffi)`` with the PortAudio functions
+used by `LvAut.device` can be selected by its import name in
+``LVAUT_AUDIO_BACKEND``.
+'''
+
+import os
+import threading
+import time
+
+import numpy as np
+
+
+__all__ = ['DUTModel', 'LoopbackDevice', 'Library', 'device', 'configure']
+
+CLOCKS = ('realtime', 'free')
+
+# PortAudio error codes, see portaudio.h
+_ERRORS = {
+    0: 'Success',
+    -9996: 'Invalid device',
+    -9998: 'Invalid number of channels',
+    -9997: 'Invalid sample rate',
+    -9994: 'Sample format not supported',
+    -9988: 'Invalid stream pointer',
+    -9983: 'Stream is stopped',
+    -9982: 'Stream is not stopped',
+    -9979: 'Host API not found',
+}
+
+
+class DUTModel(object):
+    '''Device under test between the loopback output and input.
+
+    :param delay: total delay in seconds, including the group delay of the
+        *response* filter (it is at least that group delay)
+    :param gain: gain in dB
+    :param response: ``(frequency, dB)`` breakpoints, linear in dB over log
+        frequency (flat outside); ``None`` for a flat response
+    :param harmonics: ``{order: level}`` of a Chebyshev waveshaper, e.g.
+        ``{2: 0.01, 3: 0.003}``; a full-scale sine gets exactly these
+        harmonic levels relative to the fundamental (the input is clipped
+        to +-1)
+    :param noise: white noise floor in dBFS (RMS), ``None`` for none
+    :param buzz_rate: average number of buzz events per second (Poisson)
+    :param buzz_level: level of the buzz in dBFS during an event: a square
+        wave in phase with the signal, i.e. high-order odd harmonics
+    :param buzz_duration: length of a buzz event in seconds
+    :param seed: random seed of noise and buzz
+    :param numtaps: length of the FIR filter realizing *response*
+    '''
+
+    def __init__(self, delay=0.002, gain=0.0, response=None, harmonics=None,
+                 noise=-100.0, buzz_rate=0.0, buzz_level=-40.0,
+                 buzz_duration=0.02, seed=None, numtaps=255):
+        if delay < 0:
+            raise ValueError('delay must not be negative')
+        if harmonics and min(harmonics) < 2:
+            raise ValueError('harmonic orders start at 2')
+        self.delay = delay
+        self.gain = gain
+        self.response = response
+        self.harmonics = dict(harmonics or {})
+        self.noise = noise
+        self.buzz_rate = buzz_rate
+        self.buzz_level = buzz_level
+        self.buzz_duration = buzz_duration
+        self.seed = seed
+        self.numtaps = int(numtaps) | 1  # odd: type I, any gain at Nyquist
+
+    def __repr__(self):
+        return ('DUTModel(delay={0.delay!r}, gain={0.gain!r}, '
+                'response={0.response!r}, harmonics={0.harmonics!r}, '
+                'noise={0.noise!r}, buzz_rate={0.buzz_rate!r})'.format(self))
+
+    def processor(self, samplerate, channels):
+        '''A stateful block processor for one stream.'''
+        return _DUTProcessor(self, samplerate, channels)
+
+
+def _response_fir(response, samplerate, numtaps):
+    from scipy import signal
+    freqs, db = np.array(response, dtype=np.float64).T
+    grid = np.linspace(0, samplerate / 2, 1024)
+    gains = np.interp(np.log10(np.maximum(grid, freqs[0])), np.log10(freqs),
+                      db)
+    return signal.firwin2(numtaps, grid, 10 ** (gains / 20), fs=samplerate)
+
+
+class _DUTProcessor(object):
+
+    def __init__(self, model, samplerate, channels):
+        self._rng = np.random.default_rng(model.seed)
+        self._gain = 10 ** (model.gain / 20)
+        delay = int(round(model.delay * samplerate))
+        self._fir = None
+        if model.response is not None:
+            self._fir = _response_fir(model.response, samplerate,
+                                      model.numtaps)
+            self._zi = np.zeros((len(self._fir) - 1, channels))
+            delay -= (len(self._fir) - 1) // 2
+        self._line = np.zeros((max(delay, 0), channels))
+        self._cheb = None
+        if model.harmonics:
+            self._cheb = np.zeros(max(model.harmonics) + 1)
+            self._cheb[1] = 1.0
+            for order, level in model.harmonics.items():
+                self._cheb[order] = level
+            self._cheb_dc = np.polynomial.chebyshev.chebval(0.0, self._cheb)
+        self._noise = 0.0 if model.noise is None else 10 ** (model.noise / 20)
+        self._buzz_rate = model.buzz_rate / samplerate
+        self._buzz = 10 ** (model.buzz_level / 20)
+        self._buzz_frames = max(int(model.buzz_duration * samplerate), 1)
+        self._buzz_left = 0
+        self.buzz_events = 0
+
+    def _buzz_mask(self, frames):
+        mask = np.zeros(frames, dtype=bool)
+        mask[:self._buzz_left] = True
+        left = max(self._buzz_left - frames, 0)
+        events = self._rng.poisson(self._buzz_rate * frames)
+        for start in self._rng.integers(0, frames, events):
+            mask[start:start + self._buzz_frames] = True
+            left = max(left, start + self._buzz_frames - frames)
+        self.buzz_events += events
+        self._buzz_left = left
+        return mask
+
+    def process(self, x):
+        '''DUT response to the block *x* (frames, channels).'''
+        y = x
+        if self._cheb is not None:
+            y = (np.polynomial.chebyshev.chebval(np.clip(y, -1, 1),
+                                                 self._cheb) - self._cheb_dc)
+        if self._buzz_rate:
+            mask = self._buzz_mask(len(x))
+            if mask.any():
+                y = y + self._buzz * mask[:, np.newaxis] * np.sign(x)
+        if self._fir is not None:
+            from scipy import signal
+            y, self._zi = signal.lfilter(self._fir, [1.0], y, axis=0,
+                                         zi=self._zi)
+        y = y * self._gain
+        if len(self._line):
+            y = np.concatenate([self._line, y])
+            self._line = y[len(x):]
+            y = y[:len(x)]
+        if self._noise:
+            y += self._noise * self._rng.standard_normal(y.shape)
+        return y
+
+
+class LoopbackDevice(object):
+    '''Settings of the virtual duplex device; read when a stream is
+    opened.
+
+    :param clock: ``'realtime'`` or ``'free'`` (default from
+        ``$LVAUT_LOOPBACK_CLOCK``, else ``'realtime'``)
+    :param blocksize: frames per callback if a stream doesn't specify one
+    '''
+
+    name = 'Loopback DUT'
+    hostapi_name = 'LvAut Loopback'
+
+    def __init__(self, channels=8, samplerate=48000.0, blocksize=256,
+                 clock=None, dut=None):
+        self.channels = channels
+        self.samplerate = samplerate
+        self.blocksize = blocksize
+        self.clock = (os.environ.get('LVAUT_LOOPBACK_CLOCK', 'realtime')
+                      if clock is None else clock)
+        self.dut = DUTModel() if dut is None else dut
+
+
+device = LoopbackDevice()
+
+
+def configure(**kwargs):
+    '''Change the `device` settings (*channels*, *samplerate*,
+    *blocksize*, *clock*, *dut*) for streams opened afterwards.'''
+    for name, value in kwargs.items():
+        if name not in ('channels', 'samplerate', 'blocksize', 'clock',
+                        'dut'):
+            raise TypeError('Unknown loopback setting: {!r}'.format(name))
+        if name == 'clock' and value not in CLOCKS:
+            raise ValueError('clock must be one of {}'.format(CLOCKS))
+        setattr(device, name, value)
+
+
+class _Format(object):
+    '''Conversion between a PortAudio sample format and float64.'''
+
+    def __init__(self, lib, parameters):
+        formats = {
+            lib.paFloat32: ('float32', 1.0, 0.0),
+            lib.paInt32: ('int32', 2.0 ** 31, 0.0),
+            lib.paInt16: ('int16', 2.0 ** 15, 0.0),
+            lib.paInt8: ('int8', 2.0 ** 7, 0.0),
+            lib.paUInt8: ('uint8', 2.0 ** 7, 128.0),
+        }
+        self.channels = parameters.channelCount
+        dtype, self.scale, self.offset = formats[parameters.sampleFormat]
+        self.dtype = np.dtype(dtype)
+        if self.dtype.kind in 'iu':
+            info = np.iinfo(self.dtype)
+            self.min, self.max = info.min, info.max
+
+    def view(self, ffi, ptr, frames):
+        buffer = ffi.buffer(ptr, frames * self.channels * self.dtype.itemsize)
+        return np.frombuffer(buffer, dtype=self.dtype).reshape(
+            frames, self.channels)
+
+    def to_float(self, data):
+        if self.dtype.kind == 'f':
+            return data.astype(np.float64)
+        return (data - self.offset) / self.scale
+
+    def from_float(self, y, out):
+        if self.dtype.kind == 'f':
+            out[:] = y
+        else:
+            out[:] = np.clip(np.rint(y * self.scale + self.offset),
+                             self.min, self.max)
+
+
+class _VirtualStream(object):
+
+    def __init__(self, library, iparameters, oparameters, samplerate,
+                 blocksize, callback, userdata):
+        ffi = self._ffi = library._ffi
+        lib = self._lib = library._constants
+        self.samplerate = samplerate
+        self.blocksize = blocksize or device.blocksize
+        self.realtime = device.clock == 'realtime'
+        self.input = self.output = None
+        if iparameters != ffi.NULL:
+            self.input = _Format(lib, iparameters)
+        if oparameters != ffi.NULL:
+            self.output = _Format(lib, oparameters)
+        self.dut = None
+        if self.input is not None:
+            self.dut = device.dut.processor(samplerate, self.input.channels)
+            if self.output is not None:
+                self._routing = (np.arange(self.input.channels) %
+                                 self.output.channels)
+        self.callback = callback
+        self.userdata = userdata
+        self.finished_callback = ffi.NULL
+        latency = self.blocksize / samplerate
+        self.info = ffi.new('PaStreamInfo*', (
+            1, latency if self.input else 0.0,
+            latency if self.output else 0.0, samplerate))
+        # the PaStream* is the address of this memory
+        self._handle_memory = ffi.new('char[1]')
+        self.handle = ffi.cast('PaStream*', self._handle_memory)
+        self.active = False
+        self.stopped = True
+        self.cpu_load = 0.0
+        self.frames = 0
+        self._captured = []
+        self._thread = None
+        self._stop = False
+
+    def time(self):
+        if self.realtime:
+            return time.monotonic()
+        return self.frames / self.samplerate
+
+    def _respond(self, out, frames):
+        '''DUT response to the float output frames *out* (``None`` for
+        silence) as input frames.'''
+        if out is None:
+            out = np.zeros((frames, self.input.channels))
+        else:
+            out = out[:, self._routing]
+        return self.dut.process(out)
+
+    def _pace(self, t0, frames):
+        '''Sleep until *frames* are due; return the (new) start time and
+        whether we are late by more than one block.'''
+        if not self.realtime:
+            return t0, False
+        delay = t0 + frames / self.samplerate - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+            return t0, False
+        if -delay > self.blocksize / self.samplerate:
+            return time.monotonic() - frames / self.samplerate, True
+        return t0, False
+
+    def start(self):
+        if self.active:
+            return -9982  # paStreamIsNotStopped
+        self._stop = False
+        self.active = True
+        self.stopped = False
+        self._t0 = time.monotonic()
+        if self.callback != self._ffi.NULL:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return 0
+
+    def stop(self):
+        self._stop = True
+        if self._thread is not None:
+            if self._thread is not threading.current_thread():
+                self._thread.join()
+            self._thread = None
+        elif self.active:
+            # blocking stream
+            self.active = False
+            self._finished()
+        self.stopped = True
+        return 0
+
+    def _finished(self):
+        if self.finished_callback != self._ffi.NULL:
+            self.finished_callback(self.userdata)
+
+    def _run(self):
+        ffi, lib = self._ffi, self._lib
+        frames = self.blocksize
+        block_time = frames / self.samplerate
+        ibuffer = obuffer = ffi.NULL
+        if self.input is not None:
+            ibuffer = ffi.new('char[]', frames * self.input.channels *
+                              self.input.dtype.itemsize)
+            indata = self.input.view(ffi, ibuffer, frames)
+            # the first block only contains the DUT noise
+            self.input.from_float(self._respond(None, frames), indata)
+        if self.output is not None:
+            obuffer = ffi.new('char[]', frames * self.output.channels *
+                              self.output.dtype.itemsize)
+            outdata = self.output.view(ffi, obuffer, frames)
+        time_info = ffi.new('PaStreamCallbackTimeInfo*')
+        status = 0
+        t0 = self._t0
+        try:
+            while not self._stop:
+                now = self.time()
+                time_info.currentTime = now
+                time_info.inputBufferAdcTime = now - block_time
+                time_info.outputBufferDacTime = now
+                start = time.perf_counter()
+                result = self.callback(ibuffer, obuffer, frames, time_info,
+                                       status, self.userdata)
+                load = (time.perf_counter() - start) / block_time
+                self.cpu_load = 0.9 * self.cpu_load + 0.1 * load
+                if self.input is not None:
+                    out = None
+                    if self.output is not None:
+                        out = self.output.to_float(outdata)
+                    self.input.from_float(self._respond(out, frames), indata)
+                self.frames += frames
+                if result != lib.paContinue:
+                    break
+                t0, late = self._pace(t0, self.frames)
+                status = (lib.paInputOverflow | lib.paOutputUnderflow
+                          if late else 0)
+        finally:
+            self.active = False
+            self._finished()
+
+    def write(self, ptr, frames):
+        if not self.active:
+            return -9983  # paStreamIsStopped
+        if self.input is not None:
+            data = self.output.view(self._ffi, ptr, frames)
+            self._captured.append(
+                self._respond(self.output.to_float(data), frames))
+        self.frames += frames
+        self._t0, _ = self._pace(self._t0, self.frames)
+        return 0
+
+    def read(self, ptr, frames):
+        if not self.active:
+            return -9983  # paStreamIsStopped
+        available = sum(len(block) for block in self._captured)
+        if available < frames:
+            # nothing was written for this time: the DUT gets silence
+            self._captured.append(self._respond(None, frames - available))
+            self.frames += frames - available
+            self._t0, _ = self._pace(self._t0, self.frames)
+        captured = np.concatenate(self._captured)
+        self._captured = [captured[frames:]]
+        self.input.from_float(captured[:frames],
+                              self.input.view(self._ffi, ptr, frames))
+        return 0
+
+
+class Library(object):
+    '''The subset of the PortAudio API used by `LvAut.device`, backed by
+    the virtual `device`.
+
+    Constants (``paFloat32``, ``paComplete``, ...) come from the CFFI
+    declarations of *ffi*.
+    '''
+
+    def __init__(self, ffi):
+        self._ffi = ffi
+        try:
+            self._constants = ffi.dlopen(None)
+        except OSError:
+            self._constants = ffi.dlopen('msvcrt')
+        self._streams = {}
+        self._strings = {}
+        self._device_info = None
+
+    def __getattr__(self, name):
+        # constants only; functions are methods of this class
+        if not name.startswith('pa'):
+            raise AttributeError(name)
+        return getattr(self._constants, name)
+
+    def _string(self, text):
+        try:
+            return self._strings[text]
+        except KeyError:
+            value = self._strings[text] = self._ffi.new(
+                'char[]', text.encode('utf-8'))
+            return value
+
+    def _stream(self, handle):
+        return self._streams.get(int(self._ffi.cast('uintptr_t', handle)))
+
+    # library
+
+    def Pa_Initialize(self):
+        return 0
+
+    def Pa_Terminate(self):
+        for stream in list(self._streams.values()):
+            stream.stop()
+        self._streams.clear()
+        self._device_info = None
+        return 0
+
+    def Pa_GetVersion(self):
+        return 0x130700
+
+    def Pa_GetVersionText(self):
+        return self._string('LvAut loopback (PortAudio V19.7.0 API)')
+
+    def Pa_GetErrorText(self, err):
+        return self._string(_ERRORS.get(err, 'Loopback error {}'.format(err)))
+
+    def Pa_GetLastHostErrorInfo(self):
+        return self._ffi.new('PaHostErrorInfo*', (0, 0, self._string('')))
+
+    def Pa_Sleep(self, msec):
+        time.sleep(msec / 1000)
+
+    def Pa_GetSampleSize(self, sampleformat):
+        sizes = {self.paFloat32: 4, self.paInt32: 4, self.paInt16: 2,
+                 self.paInt8: 1, self.paUInt8: 1}
+        return sizes.get(sampleformat, -9994)
+
+    # host APIs and devices
+
+    def Pa_GetHostApiCount(self):
+        return 1
+
+    def Pa_GetDefaultHostApi(self):
+        return 0
+
+    def Pa_GetHostApiInfo(self, index):
+        if index != 0:
+            return self._ffi.NULL
+        return self._ffi.new('PaHostApiInfo*', (
+            1, self.paInDevelopment, self._string(device.hostapi_name), 1,
+            0, 0))
+
+    def Pa_HostApiTypeIdToHostApiIndex(self, type):
+        return 0 if type == self.paInDevelopment else -9979
+
+    def Pa_HostApiDeviceIndexToDeviceIndex(self, hostapi, index):
+        return index if hostapi == 0 and index == 0 else -9996
+
+    def Pa_GetDeviceCount(self):
+        return 1
+
+    def Pa_GetDefaultInputDevice(self):
+        return 0
+
+    def Pa_GetDefaultOutputDevice(self):
+        return 0
+
+    def Pa_GetDeviceInfo(self, index):
+        if index != 0:
+            return self._ffi.NULL
+        block = device.blocksize / device.samplerate
+        self._device_info = self._ffi.new('PaDeviceInfo*', (
+            2, self._string(device.name), 0, device.channels,
+            device.channels, block, block, 4 * block, 4 * block,
+            device.samplerate))
+        return self._device_info
+
+    def _check_parameters(self, parameters):
+        if parameters == self._ffi.NULL:
+            return 0
+        if parameters.device != 0:
+            return -9996
+        if not 0 < parameters.channelCount <= device.channels:
+            return -9998
+        if self.Pa_GetSampleSize(parameters.sampleFormat) < 0:
+            return -9994
+        return 0
+
+    def Pa_IsFormatSupported(self, iparameters, oparameters, samplerate):
+        if samplerate <= 0:
+            return -9997
+        return (self._check_parameters(iparameters) or
+                self._check_parameters(oparameters))
+
+    # streams
+
+    def Pa_OpenStream(self, ptr, iparameters, oparameters, samplerate,
+                      blocksize, flags, callback, userdata):
+        err = self.Pa_IsFormatSupported(iparameters, oparameters, samplerate)
+        if err:
+            return err
+        stream = _VirtualStream(self, iparameters, oparameters, samplerate,
+                                blocksize, callback, userdata)
+        self._streams[int(self._ffi.cast('uintptr_t', stream.handle))] = \
+            stream
+        ptr[0] = stream.handle
+        return 0
+
+    def Pa_SetStreamFinishedCallback(self, handle, callback):
+        stream = self._stream(handle)
+        if stream is None:
+            return -9988
+        stream.finished_callback = callback
+        return 0
+
+    def Pa_GetStreamInfo(self, handle):
+        stream = self._stream(handle)
+        return self._ffi.NULL if stream is None else stream.info
+
+    def Pa_StartStream(self, handle):
+        stream = self._stream(handle)
+        return -9988 if stream is None else stream.start()
+
+    def Pa_StopStream(self, handle):
+        stream = self._stream(handle)
+        return -9988 if stream is None else stream.stop()
+
+    Pa_AbortStream = Pa_StopStream
+
+    def Pa_CloseStream(self, handle):
+        stream = self._streams.pop(
+            int(self._ffi.cast('uintptr_t', handle)), None)
+        if stream is None:
+            return -9988
+        stream.stop()
+        return 0
+
+    def Pa_IsStreamActive(self, handle):
+        stream = self._stream(handle)
+        return -9988 if stream is None else int(stream.active)
+
+    def Pa_IsStreamStopped(self, handle):
+        stream = self._stream(handle)
+        return -9988 if stream is None else int(stream.stopped)
+
+    def Pa_GetStreamTime(self, handle):
+        stream = self._stream(handle)
+        return 0.0 if stream is None else stream.time()
+
+    def Pa_GetStreamCpuLoad(self, handle):
+        stream = self._stream(handle)
+        return 0.0 if stream is None else stream.cpu_load
+
+    def Pa_GetStreamReadAvailable(self, handle):
+        stream = self._stream(handle)
+        if stream is None:
+            return -9988
+        return sum(len(block) for block in stream._captured)
+
+    def Pa_GetStreamWriteAvailable(self, handle):
+        stream = self._stream(handle)
+        return -9988 if stream is None else stream.blocksize
+
+    def Pa_ReadStream(self, handle, buffer, frames):
+        stream = self._stream(handle)
+        return -9988 if stream is None else stream.read(buffer, frames)
+
+    def Pa_WriteStream(self, handle, buffer, frames):
+        stream = self._stream(handle)
+        return -9988 if stream is None else stream.write(buffer, frames)
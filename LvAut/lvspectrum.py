@@ -4,6 +4,7 @@
 
 '''
 __version__ = "2021.8.1"
+import functools
 import warnings
 import numpy as np
 import scipy
@@ -12,11 +13,23 @@ import scipy.signal
 import scipy.interpolate
 import six
 from numpy.lib.stride_tricks import as_strided
+from . import time_frequency as core
 
 
 # Constrain STFT block sizes to 256 KB
 MAX_MEM_BLOCK = 2**8 * 2**10
 
+# Number of padded FFT windows kept by get_fft_window()
+WINDOW_CACHE_SIZE = 32
+
+# Band-limited STFTs with at most n_fft // DFT_BANK_RATIO bins are computed
+# with a direct DFT bank (one matrix product) instead of a full FFT
+DFT_BANK_RATIO = 16
+
+# FFT implementation used by the STFT functions, see set_fft_backend()
+_fft_backend = 'numpy'
+_fft_workers = None
+
 
 class LibrosaError(Exception):
     '''The root  exception class'''
@@ -28,6 +41,13 @@ class ParameterError(LibrosaError):
     pass
 
 def frame(x, frame_length=2048, hop_length=512, axis=-1):
+    '''Slice a signal into overlapping frames without copying.
+
+    The framing is a strided view along *axis*, so any leading
+    (channel) dimensions are framed independently, e.g. a
+    ``(channels, samples)`` input gives ``(channels, frame_length,
+    n_frames)`` for ``axis=-1``.
+    '''
 
     if not isinstance(x, np.ndarray):
         raise ParameterError('Input must be of type numpy.ndarray, '
@@ -41,29 +61,19 @@ def frame(x, frame_length=2048, hop_length=512, axis=-1):
         raise ParameterError('Invalid hop_length: {:d}'.format(hop_length))
 
     n_frames = 1 + (x.shape[axis] - frame_length) // hop_length
-    strides = np.asarray(x.strides)
-
-    new_stride = np.prod(strides[strides > 0] // x.itemsize) * x.itemsize
+    strides = list(x.strides)
 
     if axis == -1:
-        if not x.flags['F_CONTIGUOUS']:
-            raise ParameterError('Input array must be F-contiguous '
-                                 'for framing along axis={}'.format(axis))
-
         shape = list(x.shape)[:-1] + [frame_length, n_frames]
-        strides = list(strides) + [hop_length * new_stride]
+        strides = strides + [hop_length * strides[-1]]
 
     elif axis == 0:
-        if not x.flags['C_CONTIGUOUS']:
-            raise ParameterError('Input array must be C-contiguous '
-                                 'for framing along axis={}'.format(axis))
-
         shape = [n_frames, frame_length] + list(x.shape)[1:]
-        strides = [hop_length * new_stride] + list(strides)
+        strides = [hop_length * strides[0]] + strides
     else:
         raise ParameterError('Frame axis={} must be either 0 or -1'.format(axis))
 
-    return as_strided(x, shape=shape, strides=strides)
+    return as_strided(x, shape=shape, strides=strides, writeable=False)
 
 
 def valid_audio(y, mono=True):
@@ -85,10 +95,6 @@ def valid_audio(y, mono=True):
     if not np.isfinite(y).all():
         raise ParameterError('Audio buffer is not finite everywhere')
 
-    if not y.flags["F_CONTIGUOUS"]:
-        raise ParameterError('Audio buffer is not Fortran-contiguous. '
-                             'Use numpy.asfortranarray to ensure Fortran contiguity.')
-
     return True
 
 
@@ -129,8 +135,72 @@ def get_window(window, Nx, fftbins=True):
         raise ParameterError('Invalid window specification: {}'.format(window))
 
 
-def stft(y, n_fft=2048, hop_length=None, win_length=None, window='hann',
-         center=True, dtype=np.complex64, pad_mode='reflect'):
+@functools.lru_cache(maxsize=WINDOW_CACHE_SIZE)
+def _cached_fft_window(window, win_length, n_fft, dtype):
+    fft_window = get_window(window, win_length, fftbins=True)
+    fft_window = pad_center(fft_window, n_fft).astype(dtype, copy=False)
+    fft_window = fft_window.reshape((-1, 1))
+    # Shared between callers, so keep it read-only
+    fft_window.flags.writeable = False
+    return fft_window
+
+
+def get_fft_window(window, win_length, n_fft, dtype=np.float64):
+    '''Window padded to *n_fft* and reshaped to ``(n_fft, 1)`` for
+    broadcasting against frames.
+
+    Named windows (strings, tuples, scalars) are memoized in a bounded
+    LRU cache, see `window_cache_info`.  Callables and arrays are
+    evaluated on every call.
+    '''
+    if isinstance(window, (six.string_types, tuple)) or np.isscalar(window):
+        return _cached_fft_window(window, win_length, n_fft, np.dtype(dtype))
+
+    fft_window = get_window(window, win_length, fftbins=True)
+    fft_window = pad_center(fft_window, n_fft).astype(dtype, copy=False)
+    return fft_window.reshape((-1, 1))
+
+
+def window_cache_info():
+    '''Hit/miss statistics of the `get_fft_window` cache.'''
+    return _cached_fft_window.cache_info()
+
+
+def window_cache_clear():
+    '''Empty the `get_fft_window` cache and reset its statistics.'''
+    _cached_fft_window.cache_clear()
+
+
+def set_fft_backend(backend='numpy', workers=None):
+    '''Select the FFT used by `stft` and friends.
+
+    :param backend: ``'numpy'`` (default) or ``'scipy'``; ``scipy.fft``
+        keeps a plan cache between calls and can run multi-threaded
+    :param workers: number of threads for the scipy backend, ``-1`` uses
+        all cores
+    '''
+    global _fft_backend, _fft_workers
+    if backend not in ('numpy', 'scipy'):
+        raise ParameterError('Invalid FFT backend: {}'.format(backend))
+    if backend == 'numpy' and workers is not None:
+        raise ParameterError('workers is only supported by the scipy backend')
+    _fft_backend = backend
+    _fft_workers = workers
+
+
+def _rfft(x, axis=-1, workers=None):
+    '''Real FFT through the backend selected with `set_fft_backend`'''
+    if workers is None:
+        workers = _fft_workers
+    if _fft_backend == 'scipy' or workers is not None:
+        import scipy.fft
+        return scipy.fft.rfft(x, axis=axis, workers=workers)
+    return np.fft.rfft(x, axis=axis)
+
+
+def _stft_frames(y, n_fft, hop_length, win_length, window, center,
+                 pad_mode):
+    '''Validate, pad and frame *y*; returns the window and the frames'''
 
     # By default, use the entire frame
     if win_length is None:
@@ -140,46 +210,405 @@ def stft(y, n_fft=2048, hop_length=None, win_length=None, window='hann',
     if hop_length is None:
         hop_length = int(win_length // 4)
 
-    fft_window = get_window(window, win_length, fftbins=True)
-
-    # Pad the window out to n_fft size
-    fft_window = pad_center(fft_window, n_fft)
-
-    # Reshape so that the window can be broadcast
-    fft_window = fft_window.reshape((-1, 1))
+    # Padded out to n_fft size and reshaped so that it can be broadcast
+    fft_window = get_fft_window(window, win_length, n_fft)
 
-    # Check audio is valid
-    valid_audio(y)
+    # Check audio is valid, (channels, samples) input is transformed
+    # channel-wise in one batched FFT
+    valid_audio(y, mono=False)
 
     # Pad the time series so that frames are centered
     if center:
-        y = np.pad(y, int(n_fft // 2), mode=pad_mode)
+        padding = [(0, 0)] * (y.ndim - 1) + [(int(n_fft // 2),) * 2]
+        y = np.pad(y, padding, mode=pad_mode)
 
     # Window the time series.
     y_frames = frame(y, frame_length=n_fft, hop_length=hop_length)
 
-    # Pre-allocate the STFT matrix
-    stft_matrix = np.empty((int(1 + n_fft // 2), y_frames.shape[1]),
-                           dtype=dtype,
-                           order='F')
+    return fft_window, y_frames
+
+
+def _band_bins(sr, n_fft, fmin=None, fmax=None, bins=None):
+    '''FFT bin indices selected by *bins* or *fmin*/*fmax*, or None'''
+    n_bins = int(1 + n_fft // 2)
+    if bins is not None:
+        if fmin is not None or fmax is not None:
+            raise ParameterError('Use either bins or fmin/fmax, not both')
+        bins = np.atleast_1d(np.asarray(bins, dtype=int))
+    elif fmin is None and fmax is None:
+        return None
+    else:
+        lo = 0 if fmin is None else core.hz_to_fft_bin(fmin, sr, n_fft)
+        hi = n_bins - 1 if fmax is None else core.hz_to_fft_bin(fmax, sr,
+                                                                n_fft)
+        bins = np.arange(lo, hi + 1)
+
+    if not len(bins) or bins.min() < 0 or bins.max() >= n_bins:
+        raise ParameterError('Invalid frequency band: bins must be within '
+                             '[0, {:d}]'.format(n_bins - 1))
+    return bins
+
+
+@functools.lru_cache(maxsize=WINDOW_CACHE_SIZE)
+def _cached_dft_bank(window, win_length, n_fft, bins, dtype):
+    fft_window = get_fft_window(window, win_length, n_fft)
+    phase = (-2j * np.pi / n_fft) * np.outer(np.arange(n_fft), bins)
+    bank = np.exp(phase) * fft_window
+    bank = (np.ascontiguousarray(bank.real, dtype=dtype),
+            np.ascontiguousarray(bank.imag, dtype=dtype))
+    for b in bank:
+        b.flags.writeable = False
+    return bank
+
+
+def _dft_bank(window, win_length, n_fft, bins, dtype):
+    '''Windowed DFT columns (real, imag) for *bins*, shape
+    (n_fft, len(bins)), in the precision of the input frames'''
+    dtype = np.dtype(dtype)
+    if not np.issubdtype(dtype, np.floating):
+        dtype = np.dtype(np.float64)
+    if isinstance(window, (six.string_types, tuple)) or np.isscalar(window):
+        return _cached_dft_bank(window, win_length, n_fft,
+                                tuple(int(b) for b in bins), dtype)
+    return _cached_dft_bank.__wrapped__(window, win_length, n_fft, bins,
+                                        dtype)
+
+
+def _stft_block(fft_window, y_frames, bank, bins, workers):
+    '''Transform one block of frames: full FFT, DFT bank or FFT + slice'''
+    if bank is not None:
+        # (frames, n_fft) rows of the strided view multiply without a
+        # gather copy of the overlapping frames
+        y_frames = np.swapaxes(y_frames, -1, -2)
+        block = np.matmul(y_frames, bank[0]) + 1j * np.matmul(y_frames,
+                                                              bank[1])
+        return np.swapaxes(block, -1, -2)
+    block = _rfft(fft_window * y_frames, axis=-2, workers=workers)
+    if bins is not None:
+        block = block[..., bins, :]
+    return block
+
+
+def _band_setup(y_frames, n_fft, win_length, window, sr, fmin, fmax, bins):
+    '''Output shape, selected bins and DFT bank for a (band-limited) STFT'''
+    if win_length is None:
+        win_length = n_fft
+    bins = _band_bins(sr, n_fft, fmin=fmin, fmax=fmax, bins=bins)
+    n_bins = int(1 + n_fft // 2) if bins is None else len(bins)
+    bank = None
+    if bins is not None and len(bins) * DFT_BANK_RATIO <= n_fft:
+        bank = _dft_bank(window, win_length, n_fft, bins, y_frames.dtype)
+    shape = y_frames.shape[:-2] + (n_bins, y_frames.shape[-1])
+    return shape, bins, bank
+
 
+def _block_columns(shape, itemsize):
+    '''How many columns of *shape* can we fit within MAX_MEM_BLOCK?'''
+    n_columns = int(MAX_MEM_BLOCK / (np.prod(shape[:-1]) * itemsize))
+    return max(n_columns, 1)
 
 
-    from numpy import fft
+def stft(y, n_fft=2048, hop_length=None, win_length=None, window='hann',
+         center=True, dtype=np.complex64, pad_mode='reflect', workers=None,
+         sr=22050, fmin=None, fmax=None, bins=None):
+    '''Short-time Fourier transform.
 
-    # how many columns can we fit within MAX_MEM_BLOCK?
-    n_columns = int(MAX_MEM_BLOCK / (stft_matrix.shape[0] *
-                                          stft_matrix.itemsize))
+    With *fmin*/*fmax* (in Hz, at sample rate *sr*) or an explicit list
+    of FFT *bins*, only those rows of the full STFT are computed and
+    returned.  Narrow bands are evaluated with a DFT bank instead of a
+    full FFT.
+    '''
 
-    for bl_s in range(0, stft_matrix.shape[1], n_columns):
-        bl_t = min(bl_s + n_columns, stft_matrix.shape[1])
+    fft_window, y_frames = _stft_frames(y, n_fft, hop_length, win_length,
+                                        window, center, pad_mode)
+    shape, bins, bank = _band_setup(y_frames, n_fft, win_length, window,
+                                    sr, fmin, fmax, bins)
+
+    # Pre-allocate the STFT matrix
+    stft_matrix = np.empty(shape, dtype=dtype, order='F')
 
-        stft_matrix[:, bl_s:bl_t] = fft.rfft(fft_window *
-                                             y_frames[:, bl_s:bl_t],
-                                             axis=0)
+    n_columns = _block_columns(y_frames.shape[:-2] + (int(1 + n_fft // 2),),
+                               stft_matrix.itemsize)
+
+    for bl_s in range(0, stft_matrix.shape[-1], n_columns):
+        bl_t = min(bl_s + n_columns, stft_matrix.shape[-1])
+
+        stft_matrix[..., bl_s:bl_t] = _stft_block(fft_window,
+                                                  y_frames[..., bl_s:bl_t],
+                                                  bank, bins, workers)
     return stft_matrix
 
 
+def stft_db(y, n_fft=2048, hop_length=None, win_length=None, window='hann',
+            center=True, pad_mode='reflect', ref=1.0, amin=1e-5, top_db=80.0,
+            out=None, workers=None, sr=22050, fmin=None, fmax=None,
+            bins=None):
+    '''STFT magnitude in dB without the full-size temporaries.
+
+    Same result as ``amplitude_to_db(np.abs(stft(y, ...)), ref=ref,
+    amin=amin, top_db=top_db)``, but the magnitude and the logarithm are
+    computed per ``MAX_MEM_BLOCK`` block straight into *out*; the *ref*
+    normalisation and *top_db* clipping are done in place afterwards.
+
+    *sr*, *fmin*, *fmax* and *bins* select a frequency band as in `stft`;
+    ``ref=np.max`` then refers to the maximum within that band.
+
+    :param out: optional float32 array of shape ``(..., n_bins,
+        n_frames)`` to write into
+    :return: *out*, or a new float32 array
+    '''
+    if amin <= 0:
+        raise ParameterError('amin must be strictly positive')
+
+    if top_db is not None and top_db < 0:
+        raise ParameterError('top_db must be non-negative')
+
+    fft_window, y_frames = _stft_frames(y, n_fft, hop_length, win_length,
+                                        window, center, pad_mode)
+
+    shape, bins, bank = _band_setup(y_frames, n_fft, win_length, window,
+                                    sr, fmin, fmax, bins)
+    if out is None:
+        out = np.empty(shape, dtype=np.float32, order='F')
+    elif out.shape != shape:
+        raise ParameterError('out has shape {}, expected {}'.format(
+            out.shape, shape))
+
+    # size blocks like the complex64 matrix of stft()
+    n_columns = _block_columns(y_frames.shape[:-2] + (int(1 + n_fft // 2),),
+                               np.dtype(np.complex64).itemsize)
+
+    log_amin = np.log10(amin)
+    max_db = -np.inf
+    for bl_s in range(0, shape[-1], n_columns):
+        bl_t = min(bl_s + n_columns, shape[-1])
+
+        magnitude = np.abs(_stft_block(fft_window, y_frames[..., bl_s:bl_t],
+                                       bank, bins, workers))
+        np.maximum(magnitude, amin, out=magnitude)
+        np.log10(magnitude, out=magnitude)
+        magnitude *= 20.0
+        out[..., bl_s:bl_t] = magnitude
+        if magnitude.size:
+            max_db = max(max_db, magnitude.max())
+
+    if six.callable(ref):
+        if ref in (np.max, np.amax):
+            ref_db = max_db
+        else:
+            # Generic reference functions need the linear magnitude
+            ref_db = 20.0 * np.log10(ref(np.power(10.0, out / 20.0)))
+    else:
+        ref_db = 20.0 * np.log10(np.abs(ref))
+    ref_db = max(ref_db, 20.0 * log_amin)
+
+    out -= ref_db
+    if top_db is not None:
+        np.maximum(out, max_db - ref_db - top_db, out=out)
+
+    return out
+
+
+def _median_bias(n):
+    '''Bias of the median of n chi-squared(2) variables vs their mean'''
+    ii_2 = 2 * np.arange(1., (n - 1) // 2 + 1)
+    return 1 + np.sum(1. / (ii_2 + 1) - 1. / ii_2)
+
+
+def psd(y, sr=22050, n_fft=2048, hop_length=None, window='hann',
+        average='mean', scaling='density', workers=None):
+    '''Welch-averaged power spectrum of a steady signal.
+
+    The power of every frame is accumulated per ``MAX_MEM_BLOCK`` block,
+    so the spectrogram is never stored (except the float32 frame powers
+    needed for ``average='median'``).  Frames are not centered and not
+    detrended.
+
+    :param y: ``(samples,)`` or ``(channels, samples)`` audio
+    :param hop_length: default ``n_fft // 2`` (50 % overlap)
+    :param average: ``'mean'`` or ``'median'`` over frames
+    :param scaling: ``'density'`` gives V**2/Hz (corrected by the window
+        ENBW), ``'spectrum'`` gives V**2 per bin (corrected by the
+        coherent gain, a sine of amplitude A reads A**2 / 2)
+    :return: ``freqs, P`` with *P* of shape ``(..., 1 + n_fft // 2)``
+    '''
+    if hop_length is None:
+        hop_length = int(n_fft // 2)
+
+    if average not in ('mean', 'median'):
+        raise ParameterError('Invalid average: {}'.format(average))
+
+    fft_window, y_frames = _stft_frames(y, n_fft, hop_length, n_fft,
+                                        window, False, None)
+
+    if scaling == 'density':
+        scale = 1.0 / (sr * np.sum(np.square(fft_window)))
+    elif scaling == 'spectrum':
+        scale = 1.0 / np.sum(fft_window)**2
+    else:
+        raise ParameterError('Invalid scaling: {}'.format(scaling))
+
+    n_bins = int(1 + n_fft // 2)
+    n_frames = y_frames.shape[-1]
+    n_columns = _block_columns(y_frames.shape[:-2] + (n_bins,),
+                               np.dtype(np.complex64).itemsize)
+
+    if average == 'mean':
+        power = np.zeros(y_frames.shape[:-2] + (n_bins,))
+    else:
+        power = np.empty(y_frames.shape[:-2] + (n_bins, n_frames),
+                         dtype=np.float32)
+
+    for bl_s in range(0, n_frames, n_columns):
+        bl_t = min(bl_s + n_columns, n_frames)
+
+        block = _rfft(fft_window * y_frames[..., bl_s:bl_t], axis=-2,
+                      workers=workers)
+        block = np.square(block.real) + np.square(block.imag)
+        if average == 'mean':
+            power += np.sum(block, axis=-1)
+        else:
+            power[..., bl_s:bl_t] = block
+
+    if average == 'mean':
+        power /= n_frames
+    else:
+        power = np.median(power, axis=-1) / _median_bias(n_frames)
+
+    # one-sided spectrum: fold the negative frequencies, except DC/Nyquist
+    power *= scale
+    if n_fft % 2:
+        power[..., 1:] *= 2
+    else:
+        power[..., 1:-1] *= 2
+
+    return core.fft_frequencies(sr=sr, n_fft=n_fft), power
+
+
+def _stream_blocks(source, block_length, channel=0):
+    '''Yield 1-d sample blocks from an ndarray, a WAV path or an iterator'''
+    if isinstance(source, six.string_types):
+        from . import wavio
+        # closed when the stream finishes or the generator is dropped
+        with wavio.WavFile(source) as wav:
+            if not 0 <= channel < wav.channels:
+                raise ParameterError('Invalid channel {} for {} channels'
+                                     .format(channel, wav.channels))
+            for block in _stream_blocks(
+                    wav.blocks(block_length, channels=channel),
+                    block_length):
+                yield block
+        return
+
+    if isinstance(source, np.ndarray):
+        if source.ndim > 1:
+            # (..., samples) like stft; channels counted over the
+            # flattened leading axes
+            source = source.reshape((-1, source.shape[-1]))
+            if not 0 <= channel < len(source):
+                raise ParameterError('Invalid channel {} for {} channels'
+                                     .format(channel, len(source)))
+            source = source[channel]
+        blocks = (source[i:i + block_length]
+                  for i in range(0, len(source), block_length))
+    else:
+        blocks = iter(source)
+
+    for block in blocks:
+        block = np.asarray(block)
+        if block.ndim > 1:
+            block = block[:, channel]
+        if block.dtype == np.uint8:
+            block = (block.astype(np.float32) - 128) / 128.0
+        elif np.issubdtype(block.dtype, np.integer):
+            scale = float(-np.iinfo(block.dtype).min)
+            block = block.astype(np.float32) / scale
+        if len(block):
+            yield block
+
+
+def stft_stream(source, n_fft=2048, hop_length=None, win_length=None,
+                window='hann', center=True, dtype=np.complex64,
+                pad_mode='reflect', block_length=None, channel=0,
+                workers=None):
+    '''Short-time Fourier transform of a long signal, block by block.
+
+    Yields blocks of STFT columns which, concatenated along the last
+    axis, are identical to ``stft(y, ...)`` with the same parameters.
+    Only about ``block_length + n_fft`` samples are held in memory.
+
+    :param source: ndarray of shape ``(..., samples)`` as for `stft`,
+        WAV file path or iterable of sample blocks; multi-channel blocks
+        are ``(frames, channels)`` as read from a device or `wavio`
+    :param block_length: samples read per step for ndarray/file sources,
+        defaults to what fits into ``MAX_MEM_BLOCK``
+    :param channel: channel index (from 0) for multi-channel sources
+    '''
+    if win_length is None:
+        win_length = n_fft
+
+    if hop_length is None:
+        hop_length = int(win_length // 4)
+
+    if center and pad_mode not in ('reflect', 'symmetric', 'edge',
+                                   'constant'):
+        raise ParameterError('Invalid pad_mode for stft_stream: '
+                             '{}'.format(pad_mode))
+
+    fft_window = get_fft_window(window, win_length, n_fft)
+
+    n_bins = int(1 + n_fft // 2)
+    if block_length is None:
+        n_columns = int(MAX_MEM_BLOCK / (n_bins * np.dtype(dtype).itemsize))
+        block_length = max(n_columns, 1) * hop_length
+
+    def transform(buf):
+        y_frames = frame(buf, frame_length=n_fft, hop_length=hop_length)
+        return _rfft(fft_window * y_frames, axis=0,
+                     workers=workers).astype(dtype)
+
+    pad = int(n_fft // 2) if center else 0
+    blocks = _stream_blocks(source, block_length, channel=channel)
+
+    # Collect enough samples to build the left padding
+    head = []
+    n_head = 0
+    for block in blocks:
+        head.append(block)
+        n_head += len(block)
+        if n_head > pad:
+            break
+    if not head:
+        return
+    buf = np.concatenate(head)
+    if n_head <= pad:
+        # Whole signal is shorter than the padding: nothing to stream
+        yield stft(np.asfortranarray(buf), n_fft=n_fft,
+                   hop_length=hop_length, win_length=win_length,
+                   window=window, center=center, dtype=dtype,
+                   pad_mode=pad_mode, workers=workers)
+        return
+    if pad:
+        buf = np.concatenate((np.pad(buf[:pad + 1], (pad, 0),
+                                     mode=pad_mode)[:pad], buf))
+
+    # Keep the last pad + 1 input samples for the right padding
+    tail = buf[-(pad + 1):]
+    for block in blocks:
+        buf = np.concatenate((buf, block))
+        tail = np.concatenate((tail, block))[-(pad + 1):]
+        if len(buf) >= n_fft:
+            n_frames = 1 + (len(buf) - n_fft) // hop_length
+            yield transform(buf)
+            buf = buf[n_frames * hop_length:]
+
+    if pad:
+        buf = np.concatenate((buf, np.pad(tail, (0, pad),
+                                          mode=pad_mode)[-pad:]))
+    if len(buf) >= n_fft:
+        yield transform(buf)
+
+
 def power_to_db(S, ref=1.0, amin=1e-10, top_db=80.0):
     """
     Convert a power spectrogram (amplitude squared) to decibel (dB) units
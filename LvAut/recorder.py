@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+'''Record to disk with constant memory
+   lorry rui , Newark , USA
+
+The audio callback pushes blocks into a `RingBuffer` without taking any
+lock or allocating; a writer thread drains it into a `LvAut.wavio`
+`WavWriter`, so a recording of any length needs only the ring buffer::
+
+    import LvAut.device as sd
+    recorder = sd.rec_file('soak.wav', samplerate=48000, channels=2)
+    ...
+    sd.stop()
+    sd.wait()      # file closed, header patched
+
+The header sizes are patched every *sync_interval* seconds as well, so an
+interrupted recording keeps everything written up to then.
+'''
+
+import threading
+import time
+
+import numpy as np
+
+from . import wavio
+
+
+__all__ = ['RingBuffer', 'WavRecorder']
+
+
+class RingBuffer(object):
+    '''Single-producer / single-consumer ring buffer of frames.
+
+    The producer only advances the write counter and the consumer only the
+    read counter, so no lock is needed between one audio callback and one
+    reader thread.
+    '''
+
+    def __init__(self, frames, channels, dtype=np.float32):
+        self._data = np.zeros((int(frames), int(channels)), dtype=dtype)
+        self._written = 0
+        self._read = 0
+
+    @property
+    def capacity(self):
+        return len(self._data)
+
+    @property
+    def read_available(self):
+        return self._written - self._read
+
+    @property
+    def write_available(self):
+        return self.capacity - (self._written - self._read)
+
+    def write(self, data):
+        '''Copy as many frames of *data* as fit; returns their number.'''
+        n = min(len(data), self.write_available)
+        start = self._written % self.capacity
+        first = min(n, self.capacity - start)
+        self._data[start:start + first] = data[:first]
+        self._data[:n - first] = data[first:n]
+        self._written += n
+        return n
+
+    def peek(self, frames=None):
+        '''View of the next readable frames up to the end of the buffer
+        (no copy); release them with `advance`.'''
+        n = self.read_available
+        if frames is not None:
+            n = min(n, frames)
+        start = self._read % self.capacity
+        return self._data[start:start + min(n, self.capacity - start)]
+
+    def advance(self, frames):
+        '''Mark *frames* as consumed.'''
+        self._read += min(frames, self.read_available)
+
+
+class WavRecorder(object):
+    '''Ring buffer plus writer thread appending to a WAV/RF64 file.
+
+    `push` is meant to be called from the audio callback; the file is
+    closed by the writer thread after `finish` once the ring buffer is
+    drained.
+
+    :param buffer_seconds: ring buffer length; the writer thread must
+        catch up within this time, otherwise frames are dropped and
+        counted in `overflows`
+    :param sync_interval: seconds between header updates on disk
+    '''
+
+    def __init__(self, path, samplerate, channels, dtype=np.float32,
+                 subtype='PCM_24', buffer_seconds=2.0, sync_interval=5.0):
+        self.path = path
+        self.overflows = 0
+        self.dropped = 0
+        self.error = None
+        self._writer = wavio.WavWriter(path, samplerate, channels, subtype)
+        self._ring = RingBuffer(max(int(samplerate * buffer_seconds), 1),
+                                channels, dtype)
+        self._poll = min(0.25 * buffer_seconds, 0.05)
+        self._sync_interval = sync_interval
+        self._finished = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def frames(self):
+        '''Frames written to the file so far.'''
+        return self._writer.frames
+
+    def push(self, data):
+        '''Queue frames from the audio callback (never blocks).'''
+        n = self._ring.write(data)
+        if n < len(data):
+            self.overflows += 1
+            self.dropped += len(data) - n
+
+    def finish(self):
+        '''No more frames will be pushed; the writer thread drains the
+        buffer and closes the file.'''
+        self._finished = True
+
+    def join(self, timeout=None):
+        '''Wait for the file to be closed.'''
+        self._thread.join(timeout)
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        self.finish()
+        self.join()
+
+    def _run(self):
+        last_sync = time.monotonic()
+        try:
+            while True:
+                finished = self._finished
+                block = self._ring.peek()
+                if len(block):
+                    self._writer.write(block)
+                    self._ring.advance(len(block))
+                # also under sustained input, not only when idle
+                if time.monotonic() - last_sync > self._sync_interval:
+                    self._writer.sync()
+                    last_sync = time.monotonic()
+                if len(block):
+                    continue
+                if finished:
+                    break
+                time.sleep(self._poll)
+        except Exception as e:
+            self.error = e
+        finally:
+            self._writer.close()
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+'''Per-stream callback timing and xrun statistics
+   lorry rui , Newark , USA
+
+Enabled per stream with `LvAut.device.Stream.enable_stats()` (or for every
+new stream with ``default.stats = True``) and read with ``stream.stats()``::
+
+    import LvAut.device as sd
+    sd.default.stats = True
+    sd.default.stats_file = 'station7-stats.jsonl'   # one line per wait()
+    sd.playrec(stimulus, samplerate=48000, channels=2)
+    sd.wait()
+    sd.get_stream().stats()['callback_time']['p99']
+
+Only the audio thread writes the counters, and a snapshot copies them,
+so recording takes no lock.  Durations go into a log-linear histogram
+(HDR-style: 16 linear sub-buckets per power of two of microseconds,
+i.e. about 6 % resolution) so percentiles are available without keeping
+the samples.
+'''
+
+import time
+
+
+__all__ = ['Histogram', 'StreamStats']
+
+# linear sub-buckets per power of two
+_SUB_BITS = 4
+_SUB = 1 << _SUB_BITS
+
+
+def _bucket(value):
+    if value < 2 * _SUB:
+        return value
+    shift = value.bit_length() - _SUB_BITS - 1
+    return _SUB * shift + (value >> shift)
+
+
+def _lower(index):
+    if index < 2 * _SUB:
+        return index
+    shift = index // _SUB - 1
+    return (index - _SUB * shift) << shift
+
+
+class Histogram(object):
+    '''Log-linear histogram of durations in seconds, in microsecond
+    resolution up to *max_seconds* (larger values go to the last bucket).
+    '''
+
+    def __init__(self, max_seconds=10.0):
+        self._max = int(max_seconds * 1e6)
+        self.counts = [0] * (_bucket(self._max) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, seconds):
+        us = int(seconds * 1e6)
+        self.counts[_bucket(min(max(us, 0), self._max))] += 1
+        self.count += 1
+        self.total += seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+
+    def percentile(self, q, counts=None):
+        '''Lower edge of the bucket holding the *q*-th percentile, in
+        seconds.'''
+        counts = self.counts if counts is None else counts
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q / 100.0 * total
+        seen = 0
+        for index, n in enumerate(counts):
+            seen += n
+            if n and seen >= rank:
+                return _lower(index) * 1e-6
+        return self.max
+
+    def snapshot(self):
+        counts = list(self.counts)
+        count = sum(counts)
+        if not count:
+            return {'count': 0}
+        return {
+            'count': count,
+            'mean': self.total / max(self.count, 1),
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50, counts),
+            'p90': self.percentile(90, counts),
+            'p99': self.percentile(99, counts),
+            'p99.9': self.percentile(99.9, counts),
+            # [bucket lower edge in seconds, count]
+            'histogram': [[_lower(i) * 1e-6, n]
+                          for i, n in enumerate(counts) if n],
+        }
+
+
+class StreamStats(object):
+    '''Statistics of the callbacks of one stream.
+
+    :param samplerate: to count callbacks taking longer than their block
+    :param xrun_flags: ``{name: bit}`` of the callback status flags
+    :param cpu_load: callable returning the stream's CPU load, sampled
+        every *cpu_load_interval* callbacks
+    :param input, output: whether the stream has input/output, i.e.
+        which of the buffer time deltas are meaningful
+    '''
+
+    def __init__(self, samplerate, xrun_flags, cpu_load=None,
+                 cpu_load_interval=16, input=True, output=True):
+        if cpu_load_interval < 1:
+            raise ValueError('cpu_load_interval must be at least 1')
+        self.samplerate = samplerate
+        self.callback_time = Histogram()
+        self.input_delay = Histogram() if input else None
+        self.output_delay = Histogram() if output else None
+        self.block_sizes = {}
+        self.over_budget = 0
+        self._xrun_flags = list(xrun_flags.items())
+        self.xruns = dict.fromkeys(xrun_flags, 0)
+        self._cpu_load = cpu_load
+        self._cpu_load_interval = cpu_load_interval
+        self.cpu_load_samples = 0
+        self.cpu_load_total = 0.0
+        self.cpu_load_max = 0.0
+        self.cpu_load_last = None
+        self.created = time.time()
+        self.first = self.last = None
+
+    def record(self, elapsed, frames, time_info, flags):
+        '''Called from the audio thread after each callback.'''
+        now = time.monotonic()
+        if self.first is None:
+            self.first = now
+        self.last = now
+        self.callback_time.add(elapsed)
+        self.block_sizes[frames] = self.block_sizes.get(frames, 0) + 1
+        if frames and elapsed * self.samplerate > frames:
+            self.over_budget += 1
+        if flags:
+            for name, bit in self._xrun_flags:
+                if flags & bit:
+                    self.xruns[name] += 1
+        current = time_info.currentTime
+        if current:
+            # some host APIs don't provide the buffer times (all zero)
+            if self.input_delay is not None and time_info.inputBufferAdcTime:
+                self.input_delay.add(current - time_info.inputBufferAdcTime)
+            if (self.output_delay is not None and
+                    time_info.outputBufferDacTime):
+                self.output_delay.add(time_info.outputBufferDacTime - current)
+        # the first callback and every cpu_load_interval-th after it
+        if (self._cpu_load is not None and
+                (self.callback_time.count - 1) %
+                self._cpu_load_interval == 0):
+            load = self._cpu_load()
+            self.cpu_load_samples += 1
+            self.cpu_load_total += load
+            self.cpu_load_max = max(self.cpu_load_max, load)
+            self.cpu_load_last = load
+
+    def snapshot(self):
+        '''JSON-serializable dictionary of the current statistics.'''
+        snapshot = {
+            'created': self.created,
+            'duration': (self.last - self.first
+                         if self.first is not None else 0.0),
+            'samplerate': self.samplerate,
+            'callbacks': self.callback_time.count,
+            'callback_time': self.callback_time.snapshot(),
+            'over_budget': self.over_budget,
+            'block_sizes': dict(self.block_sizes),
+            'xruns': dict(self.xruns),
+        }
+        if self.input_delay is not None:
+            snapshot['input_delay'] = self.input_delay.snapshot()
+        if self.output_delay is not None:
+            snapshot['output_delay'] = self.output_delay.snapshot()
+        if self._cpu_load is not None:
+            samples = self.cpu_load_samples
+            snapshot['cpu_load'] = {
+                'samples': samples,
+                'mean': self.cpu_load_total / samples if samples else None,
+                'max': self.cpu_load_max,
+                'last': self.cpu_load_last,
+            }
+        return snapshot
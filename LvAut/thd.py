@@ -0,0 +1,695 @@
+# -*- coding: utf-8 -*-
+'''Sweep tone THD / power / rub&buzz analysis (pure NumPy/SciPy)
+   lorry rui , Newark , USA
+
+Drop-in replacement for the Windows-only ``lvaut_THD`` analysis
+functions ``load``, ``write``, ``analyze_sweep`` and ``diplaychart``::
+
+    import LvAut.thd as AUT
+    freq,thdh,thd_N,power,Freq_THD,thd_data,Freq_Power,PowerS,RubBuzz_data=\
+        AUT.analyze_sweep(filename, trigeFrequncy, stopananlysis, channel)
+
+All per-frame work is done on the whole STFT matrix at once, no Python
+loop over frames.  Sweep results are kept in the on-disk cache of
+`LvAut.cache` when it is enabled.
+'''
+
+import functools
+
+import numpy as np
+import scipy.fft
+import scipy.io.wavfile
+import scipy.signal
+
+from . import cache
+from . import lvspectrum as lvs
+from . import time_frequency as core
+from . import wavio
+from .lvspectrum import ParameterError
+
+
+__all__ = ['load', 'write', 'analyze_sweep', 'analyze_sweep_data',
+           'diplaychart', 'tone_thd', 'track_sweep', 'sweep_curves',
+           'rub_buzz', 'rub_buzz_curves', 'notch_thd_n', 'align', 'crop',
+           'analyze_sweep_response']
+
+HOP_SIZE = 1024
+FRAME_SIZE = 4096
+
+# frames quieter than this (relative to the loudest frame) are silence
+GATE_DB = -60.0
+
+# harmonic orders used for the rub&buzz estimate
+RUB_BUZZ_ORDERS = (10, 35)
+
+# number of notch / band-limit filter designs kept by `notch_thd_n`
+FILTER_CACHE_SIZE = 64
+
+# pass band of the ``band='audio'`` limit of `notch_thd_n` [Hz]
+AUDIO_BAND = (20.0, 20000.0)
+
+# correlation samples on each side of the peak interpolated by `align`
+_ALIGN_TAPS = 32
+
+_subtypes = {
+    'PCM_16': np.int16,
+    'PCM_32': np.int32,
+    'FLOAT': np.float32,
+    'DOUBLE': np.float64,
+}
+
+
+def load(filename):
+    '''Load a WAV file as floating point audio.
+
+    Returns ``(signal, sample_rate, channels)``; *signal* has shape
+    ``(samples,)`` for mono files and ``(samples, channels)`` otherwise,
+    scaled to [-1, 1).
+    '''
+    with wavio.WavFile(filename) as wav:
+        return wav.read(), wav.samplerate, wav.channels
+
+
+def load_channel(filename, channel=1):
+    '''Load only channel *channel* (starting with 1) of a WAV file.
+
+    Returns ``(signal, sample_rate)``; the other channels are never
+    converted, see `LvAut.wavio`.
+    '''
+    with wavio.WavFile(filename) as wav:
+        if not 1 <= channel <= wav.channels:
+            raise ParameterError('Invalid channel: {}'.format(channel))
+        return wav.read(channels=channel - 1), wav.samplerate
+
+
+def write(filename, data, fs, subtype='PCM_16'):
+    '''Write floating point audio to a WAV file.
+
+    *subtype* is one of ``'PCM_16'``, ``'PCM_32'``, ``'FLOAT'``,
+    ``'DOUBLE'``.
+    '''
+    try:
+        dtype = _subtypes[subtype]
+    except KeyError:
+        raise ParameterError('Invalid subtype: {!r}'.format(subtype))
+    data = np.asarray(data)
+    if np.issubdtype(dtype, np.integer) and \
+            np.issubdtype(data.dtype, np.floating):
+        # float64: scale - 1 is not representable in float32 for PCM_32
+        scale = -np.iinfo(dtype).min
+        data = np.clip(np.round(np.asarray(data, np.float64) * scale),
+                       -scale, scale - 1)
+    scipy.io.wavfile.write(filename, int(fs), data.astype(dtype))
+
+
+def select_channel(y, channel=1):
+    '''Return channel *channel* (starting with 1) as F-contiguous mono.'''
+    if y.ndim > 1:
+        if not 1 <= channel <= y.shape[1]:
+            raise ParameterError('Invalid channel: {}'.format(channel))
+        y = y[:, channel - 1]
+    return np.asfortranarray(y, dtype=np.float32)
+
+
+def amplitude_spectrogram(y, sr, n_fft=FRAME_SIZE, hop_length=HOP_SIZE,
+                          window='hann'):
+    '''Magnitude STFT scaled so that a full-scale sine reads 1.0.'''
+    S = np.abs(lvs.stft(y, n_fft=n_fft, hop_length=hop_length,
+                        window=window))
+    S *= 2.0 / np.sum(lvs.get_fft_window(window, n_fft, n_fft))
+    return S
+
+
+def track_fundamental(S, fmin_bin=1, fmax_bin=None):
+    '''Column-wise argmax of *S* restricted to ``[fmin_bin, fmax_bin)``.
+
+    *S* has shape ``(..., n_bins, n_frames)``.  Returns the fundamental
+    bin index and its amplitude for every frame, shape ``(..., n_frames)``.
+    '''
+    if fmax_bin is None:
+        fmax_bin = S.shape[-2]
+    fmin_bin = max(int(fmin_bin), 1)
+    peak = fmin_bin + np.argmax(S[..., fmin_bin:fmax_bin, :], axis=-2)
+    level = np.take_along_axis(S, peak[..., np.newaxis, :], axis=-2)[..., 0, :]
+    return peak, level
+
+
+def interpolate_peak(S, peak):
+    '''Fractional bin of each *peak* by parabolic interpolation of the
+    log magnitude over the peak bin and its neighbours.'''
+    n_bins = S.shape[-2]
+    idx = np.clip(peak, 1, n_bins - 2)[..., np.newaxis, :]
+    a, b, c = (np.log(np.maximum(np.take_along_axis(S, idx + offset,
+                                                    axis=-2)[..., 0, :],
+                                 1e-20))
+               for offset in (-1, 0, 1))
+    curvature = a - 2 * b + c
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta = np.where(curvature < 0, 0.5 * (a - c) / curvature, 0.0)
+    delta = np.clip(delta, -0.5, 0.5)
+    delta[(peak < 1) | (peak > n_bins - 2)] = 0.0
+    return peak + delta
+
+
+def harmonic_amplitudes(S, peak, orders):
+    '''Gather the amplitude of harmonic *orders* for every frame.
+
+    *peak* is the (possibly fractional, see `interpolate_peak`)
+    fundamental bin per frame.  Each harmonic is read as the maximum over
+    the bin nearest to ``k * peak`` and its two neighbours, harmonics
+    above Nyquist read as 0.
+    Returns an array of shape ``(..., len(orders), n_frames)``.
+    '''
+    orders = np.asarray(orders).reshape((-1, 1))
+    n_bins = S.shape[-2]
+    hbin = np.ceil(orders * peak[..., np.newaxis, :] - 0.5).astype(int)
+    amp = np.zeros(hbin.shape, dtype=S.dtype)
+    for offset in (-1, 0, 1):
+        idx = np.clip(hbin + offset, 0, n_bins - 1)
+        np.maximum(amp, np.take_along_axis(S, idx, axis=-2), out=amp)
+    amp[hbin >= n_bins - 1] = 0
+    return amp
+
+
+def sweep_curves(S, sr, n_fft, fmin=20.0, fmax=None, n_harmonics=5):
+    '''THD, level and harmonic curves of a sweep from its spectrogram.
+
+    The fundamental of every frame is the column-wise argmax of the
+    amplitude spectrogram *S* (see `amplitude_spectrogram`, shape
+    ``(..., n_bins, n_frames)``) within ``[fmin, fmax]``; harmonics
+    2 .. n_harmonics + 1 are gathered for all frames at once.
+
+    :return: ``freqs, level, thd, harmonics``: fundamental frequency
+        [Hz], fundamental level [dB], THD [%] per frame and the harmonic
+        levels [dB] with shape ``(..., n_harmonics, n_frames)``
+    '''
+    fmin_bin = core.hz_to_fft_bin(fmin, sr, n_fft)
+    fmax_bin = None if fmax is None else core.hz_to_fft_bin(fmax, sr,
+                                                            n_fft) + 1
+    peak, level = track_fundamental(S, fmin_bin, fmax_bin)
+    peak = interpolate_peak(S, peak)
+    level = np.maximum(level, 1e-10)
+
+    harmonics = harmonic_amplitudes(S, peak, np.arange(2, 2 + n_harmonics))
+    thd = 100.0 * np.sqrt(np.sum(np.square(harmonics), axis=-2)) / level
+
+    freqs = peak * (float(sr) / n_fft)
+    with np.errstate(divide='ignore'):
+        harmonics = 20.0 * np.log10(harmonics)
+    return freqs, 20.0 * np.log10(level), thd, harmonics
+
+
+@cache.memoize
+def track_sweep(y, sr, fmin=20.0, fmax=None, n_harmonics=5,
+                n_fft=FRAME_SIZE, hop_length=HOP_SIZE, window='hann'):
+    '''THD(f), level(f) and per-harmonic curves of a sweep recording.
+
+    *y* is ``(samples,)`` or ``(channels, samples)``; every STFT frame is
+    analyzed in one vectorized pass, see `sweep_curves`.
+    '''
+    S = amplitude_spectrogram(y, sr, n_fft=n_fft, hop_length=hop_length,
+                              window=window)
+    return sweep_curves(S, sr, n_fft, fmin=fmin, fmax=fmax,
+                        n_harmonics=n_harmonics)
+
+
+def harmonic_ratio(S, peak, level, orders):
+    '''RSS of harmonics *orders* relative to *level*, in percent.'''
+    amp = harmonic_amplitudes(S, peak, orders)
+    return 100.0 * np.sqrt(np.sum(np.square(amp), axis=-2)) / level
+
+
+def residual_crest(D, peak, orders, window='hann'):
+    '''Crest factor of the high-pass residual of every STFT frame.
+
+    All bins below ``orders[0] - 0.5`` times the tracked fundamental
+    *peak* (fractional bin per frame) are removed from the complex STFT
+    *D*, the frames are transformed back and the analysis window is
+    divided out over the middle half of the frame.  Peak and RMS are
+    taken over the whole number of fundamental periods that fit in that
+    region, so the crest factor does not depend on the phase of a
+    once-per-period rattle.
+
+    :return: crest factor (peak / RMS, linear) of shape ``(..., n_frames)``
+    '''
+    n_bins, n_frames = D.shape[-2:]
+    n_fft = 2 * (n_bins - 1)
+    cutoff = (orders[0] - 0.5) * peak[..., np.newaxis, :]
+    bins = np.arange(n_bins).reshape((-1, 1))
+    residual = np.fft.irfft(np.where(bins >= cutoff, D, 0), n=n_fft, axis=-2)
+
+    start, stop = n_fft // 4, n_fft - n_fft // 4
+    fft_window = lvs.get_fft_window(window, n_fft, n_fft)[start:stop]
+    residual = residual[..., start:stop, :] / fft_window
+
+    # whole periods of the fundamental, at least one region long if the
+    # period does not fit
+    length = stop - start
+    period = n_fft / np.maximum(peak, 1.0)
+    usable = np.where(period < length,
+                      np.floor(length / period) * period, length)
+    mask = np.arange(length).reshape((-1, 1)) < usable[..., np.newaxis, :]
+
+    residual = np.where(mask, residual, 0.0)
+    rms = np.sqrt(np.sum(np.square(residual), axis=-2) /
+                  np.sum(mask, axis=-2))
+    return np.max(np.abs(residual), axis=-2) / np.maximum(rms, 1e-20)
+
+
+def rub_buzz_curves(D, sr, fmin=20.0, fmax=None, orders=RUB_BUZZ_ORDERS,
+                    window='hann'):
+    '''Rub & buzz curves of a sweep from its complex STFT.
+
+    *D* is the output of `lvspectrum.stft` (shape ``(..., n_bins,
+    n_frames)``) computed with *window*.  For every frame the
+    fundamental is tracked within ``[fmin, fmax]``, the RSS of harmonics
+    ``orders[0] .. orders[1]`` is measured relative to it, and the crest
+    factor of the residual above ``orders[0]`` is computed, see
+    `residual_crest`.
+
+    :return: ``freqs, rub_buzz, crest``: fundamental frequency [Hz],
+        high-order harmonic ratio [%] and residual crest factor [dB],
+        each of shape ``(..., n_frames)``
+    '''
+    n_fft = 2 * (D.shape[-2] - 1)
+    S = np.abs(D)
+    S *= 2.0 / np.sum(lvs.get_fft_window(window, n_fft, n_fft))
+
+    fmin_bin = core.hz_to_fft_bin(fmin, sr, n_fft)
+    fmax_bin = None if fmax is None else core.hz_to_fft_bin(fmax, sr,
+                                                            n_fft) + 1
+    peak, level = track_fundamental(S, fmin_bin, fmax_bin)
+    peak = interpolate_peak(S, peak)
+    level = np.maximum(level, 1e-10)
+
+    low, high = orders
+    rub_buzz = harmonic_ratio(S, peak, level, np.arange(low, high + 1))
+    with np.errstate(divide='ignore'):
+        # no residual below Nyquist reads -inf
+        crest = 20.0 * np.log10(residual_crest(D, peak, orders,
+                                               window=window))
+    return peak * (float(sr) / n_fft), rub_buzz, crest
+
+
+@cache.memoize
+def rub_buzz(y, sr, fmin=20.0, fmax=None, orders=RUB_BUZZ_ORDERS,
+             n_fft=FRAME_SIZE, hop_length=HOP_SIZE, window='hann'):
+    '''Rub & buzz curves of a sweep recording.
+
+    *y* is ``(samples,)`` or ``(channels, samples)``; the whole sweep is
+    analyzed in one batched pass, see `rub_buzz_curves`.
+    '''
+    D = lvs.stft(y, n_fft=n_fft, hop_length=hop_length, window=window)
+    return rub_buzz_curves(D, sr, fmin=fmin, fmax=fmax, orders=orders,
+                           window=window)
+
+
+def thd_n(S, peak, frames, lobe=3):
+    '''THD+N in percent for the given *frames* of *S*.
+
+    Everything outside the main lobe of the fundamental (and DC) is
+    counted as distortion plus noise.
+    '''
+    frames = np.atleast_1d(frames)
+    power = np.square(S[:, frames])
+    bins = np.arange(S.shape[0])[:, np.newaxis]
+    lobe_mask = np.abs(bins - peak[frames][np.newaxis, :]) <= lobe
+    lobe_mask[:lobe] = False
+    fundamental = np.sum(power * lobe_mask, axis=0)
+    residual = np.sum(power * ~lobe_mask, axis=0) - np.sum(power[:lobe], axis=0)
+    return 100.0 * np.sqrt(residual / np.maximum(fundamental, 1e-20))
+
+
+def sweep_frames(f_peak, active, trigeFrequncy, stopananlysis):
+    '''Select the frames of a high-to-low sweep.
+
+    The analysis starts at the first active frame above *trigeFrequncy*
+    after the trigger tone (or the first one at all if there is no
+    trigger tone) and stops once the sweep falls below *stopananlysis*.
+    With ``trigeFrequncy=None`` (a response cropped with `align`), all
+    active frames at or above *stopananlysis* are used, in either sweep
+    direction.
+    '''
+    if trigeFrequncy is None:
+        frames = np.flatnonzero(active & (f_peak >= stopananlysis))
+        if not len(frames):
+            raise ParameterError('No sweep above {} Hz found'.format(
+                stopananlysis))
+        return frames
+    tolerance = max(0.05 * trigeFrequncy, 1.0)
+    trigger = active & (np.abs(f_peak - trigeFrequncy) <= tolerance)
+    above = active & (f_peak > trigeFrequncy + tolerance)
+    begin = np.flatnonzero(trigger)
+    begin = begin[0] if len(begin) else 0
+    start = np.flatnonzero(above[begin:])
+    if not len(start):
+        raise ParameterError('No sweep above {} Hz found'.format(
+            trigeFrequncy))
+    start = begin + start[0]
+    stop = np.flatnonzero(active[start:] & (f_peak[start:] < stopananlysis))
+    stop = start + stop[0] if len(stop) else len(f_peak)
+    frames = np.arange(start, stop)
+    return frames[active[frames]]
+
+
+@cache.memoize
+def analyze_sweep_data(y, sr, trigeFrequncy=400, stopananlysis=100,
+                       n_fft=FRAME_SIZE, hop_length=HOP_SIZE,
+                       number_harmonic=5):
+    '''`analyze_sweep` on a mono signal already in memory.'''
+    S = amplitude_spectrogram(y, sr, n_fft=n_fft, hop_length=hop_length)
+    freqs = core.fft_frequencies(sr=sr, n_fft=n_fft)
+
+    peak, level = track_fundamental(S)
+    f_peak = freqs[peak]
+    active = level > np.max(level) * 10.0**(GATE_DB / 20.0)
+    frames = sweep_frames(f_peak, active, trigeFrequncy, stopananlysis)
+
+    peak, f_peak = peak[frames], f_peak[frames]
+    S = S[:, frames]
+    _, power_db, thd, _ = sweep_curves(S, sr, n_fft, fmin=0.0,
+                                       n_harmonics=number_harmonic)
+    level = 10.0**(power_db / 20.0)
+
+    low, high = RUB_BUZZ_ORDERS
+    rub_buzz = harmonic_ratio(S, peak, level, np.arange(low, high + 1))
+
+    # THD needs at least the 2nd harmonic below Nyquist
+    thd_frames = 2 * peak < S.shape[0] - 1
+    loudest = np.argmax(level)
+
+    freq = f_peak[loudest]
+    thdh = np.max(thd[thd_frames]) if np.any(thd_frames) else 0.0
+    thd_N = thd_n(S, peak, loudest)[0]
+    power = power_db[loudest]
+
+    return (freq, thdh, thd_N, power,
+            f_peak[thd_frames], thd[thd_frames],
+            f_peak, power_db,
+            rub_buzz[thd_frames])
+
+
+def align(stimulus, response, max_delay=None, allow_inverted=False):
+    '''Delay of *response* relative to *stimulus* in samples.
+
+    The peak of the FFT cross-correlation is refined by band-limited
+    interpolation and a parabolic fit, so the delay is fractional.  Only
+    delays from 0 to *max_delay* samples (default: any that fits into
+    *response*) are searched.  The response is expected to have the
+    polarity of the stimulus; with *allow_inverted* the peak of the
+    correlation magnitude is taken instead, which for periodic or
+    narrowband stimuli may be off by half a period.
+
+    :return: ``delay, correlation``; *correlation* is the normalized
+        correlation at the interpolated peak (negative for an inverted
+        response, near 0 if the response doesn't contain the stimulus)
+    '''
+    x = np.asarray(stimulus, dtype=np.float64)
+    y = np.asarray(response, dtype=np.float64)
+    if x.ndim != 1 or y.ndim != 1:
+        raise ParameterError('align needs mono stimulus and response')
+    if not len(x) or not len(y):
+        raise ParameterError('Empty stimulus or response')
+
+    n_fft = scipy.fft.next_fast_len(len(x) + len(y) - 1, real=True)
+    # xc[k] = sum(y[t + k] * x[t]): lag k >= 0 at index k, negative lags
+    # wrap around to the end
+    xc = np.fft.irfft(np.fft.rfft(y, n_fft) * np.conj(np.fft.rfft(x, n_fft)),
+                      n_fft)
+    last = len(y) - 1
+    if max_delay is not None:
+        last = min(int(max_delay), last)
+    if allow_inverted:
+        lag = int(np.argmax(np.abs(xc[:last + 1])))
+    else:
+        lag = int(np.argmax(xc[:last + 1]))
+    sign = -1.0 if xc[lag] < 0 else 1.0
+
+    delta = 0.0
+    peak = xc[lag]
+    if 0 < lag < last:
+        # the peak of a broadband correlation is sinc- rather than
+        # parabola-shaped: sinc-interpolate the neighbourhood of the
+        # integer peak on a 1/10 sample grid, then fit the parabola there
+        offsets = np.linspace(-1, 1, 21)
+        taps = np.arange(lag - _ALIGN_TAPS, lag + _ALIGN_TAPS + 1)
+        neighbourhood = np.take(xc, taps, mode='wrap')
+        values = sign * np.dot(
+            np.sinc((lag + offsets)[:, np.newaxis] - taps), neighbourhood)
+        i = min(max(int(np.argmax(values)), 1), len(offsets) - 2)
+        a, b, c = values[i - 1:i + 2]
+        curvature = a - 2 * b + c
+        step = offsets[1] - offsets[0]
+        delta = offsets[i]
+        if curvature < 0:
+            delta += 0.5 * step * (a - c) / curvature
+        peak = np.dot(np.sinc(lag + delta - taps), neighbourhood)
+
+    segment = y[lag:lag + len(x)]
+    norm = np.sqrt(np.dot(x[:len(segment)], x[:len(segment)]) *
+                   np.dot(segment, segment))
+    correlation = peak / norm if norm > 0 else 0.0
+    return lag + delta, correlation
+
+
+def crop(response, delay, frames):
+    '''*frames* samples of *response* (along the first axis, as returned
+    by ``playrec``) from the rounded *delay* on, zero-padded at the end.'''
+    response = np.asarray(response)
+    start = int(round(delay))
+    y = response[start:start + frames]
+    if len(y) < frames:
+        pad = [(0, frames - len(y))] + [(0, 0)] * (response.ndim - 1)
+        y = np.pad(y, pad)
+    return y
+
+
+def analyze_sweep_response(stimulus, response, sr, stopananlysis=100,
+                           delay=None, **kwargs):
+    '''`analyze_sweep_data` of a response aligned to its *stimulus*.
+
+    The response is cropped to the stimulus at *delay* (estimated with
+    `align` if not given), so the sweep may go in either direction and
+    needs no trigger tone.  Extra keyword arguments are passed to
+    `analyze_sweep_data`.
+    '''
+    if delay is None:
+        delay, _ = align(stimulus, response)
+    y = crop(response, delay, len(stimulus))
+    return analyze_sweep_data(y, sr, None, stopananlysis, **kwargs)
+
+
+def _tone_basis(freqs, sr, start, stop):
+    '''cos/sin rows of shape (stop - start, len(freqs)) for samples
+    start..stop'''
+    n = np.arange(start, stop, dtype=np.float64)[:, np.newaxis]
+    # reduce the phase to [0, 1) cycles before scaling to keep precision
+    phase = 2.0 * np.pi * np.mod(n * freqs[np.newaxis, :] / sr, 1.0)
+    return np.cos(phase), np.sin(phase)
+
+
+def tone_thd(y, sr, f0=1000, n_harmonics=5, frame_length=None,
+             hop_length=None, window='hann'):
+    '''Harmonic levels, THD and THD+N of a single tone.
+
+    The fundamental and harmonics ``2 * f0 .. (n_harmonics + 1) * f0``
+    are measured with a windowed DFT bank at their exact frequencies
+    (a vectorized Goertzel), i.e. O(N * H) instead of a full spectrogram.
+
+    :param y: ``(samples,)`` or ``(channels, samples)`` floating point
+        audio
+    :param frame_length: if given, measure per frame of this length
+        (every *hop_length* samples, default ``frame_length // 4``)
+        instead of over the whole signal
+    :return: ``levels, thd, thd_N``; *levels* are the amplitudes in dB
+        (full scale = 0 dB) with shape ``(..., n_harmonics + 1)`` for the
+        whole signal or ``(..., n_harmonics + 1, n_frames)`` per frame,
+        index 0 being the fundamental. Harmonics above Nyquist read
+        ``-inf``. *thd* and *thd_N* are in percent.
+    '''
+    y = np.asarray(y)
+    lvs.valid_audio(y, mono=False)
+    if f0 <= 0 or f0 >= sr / 2.0:
+        raise ParameterError('f0={} outside (0, sr/2)'.format(f0))
+
+    freqs = f0 * np.arange(1, n_harmonics + 2, dtype=np.float64)
+    audible = freqs < sr / 2.0
+
+    if frame_length is None:
+        fft_window = lvs.get_window(window, y.shape[-1], fftbins=True)
+        segments = (y - np.mean(y, axis=-1, keepdims=True))
+    else:
+        if hop_length is None:
+            hop_length = int(frame_length // 4)
+        fft_window = lvs.get_window(window, frame_length, fftbins=True)
+        segments = np.swapaxes(lvs.frame(y, frame_length=frame_length,
+                                         hop_length=hop_length), -1, -2)
+        segments = segments - np.mean(segments, axis=-1, keepdims=True)
+
+    # harmonics are on the last axis from here on, accumulated in blocks
+    # of samples to bound the size of the basis
+    n = segments.shape[-1]
+    re = np.zeros(segments.shape[:-1] + (len(freqs),))
+    im = np.zeros_like(re)
+    block = max(int(lvs.MAX_MEM_BLOCK // (16 * len(freqs))), 1)
+    for bl_s in range(0, n, block):
+        bl_t = min(bl_s + block, n)
+        cos, sin = _tone_basis(freqs, sr, bl_s, bl_t)
+        seg = segments[..., bl_s:bl_t] * fft_window[bl_s:bl_t]
+        re += np.matmul(seg, cos)
+        im -= np.matmul(seg, sin)
+    energy = np.sum(np.square(segments * fft_window), axis=-1)
+
+    amplitude = 2.0 * np.hypot(re, im) / np.sum(fft_window)
+    amplitude[..., ~audible] = 0.0
+
+    fundamental = np.maximum(amplitude[..., 0], 1e-10)
+    thd = 100.0 * np.sqrt(np.sum(np.square(amplitude[..., 1:]),
+                                 axis=-1)) / fundamental
+
+    # windowed energy of a sine with amplitude A is A**2 / 2 * sum(w**2)
+    total = 2.0 * energy / np.sum(np.square(fft_window))
+    residual = np.maximum(total - np.square(fundamental), 0.0)
+    thd_N = 100.0 * np.sqrt(residual) / fundamental
+
+    with np.errstate(divide='ignore'):
+        levels = 20.0 * np.log10(amplitude)
+    if frame_length is not None:
+        levels = np.swapaxes(levels, -1, -2)
+    return levels, thd, thd_N
+
+
+def _readonly(sos):
+    # cached designs are shared between callers; sosfilt needs a
+    # writable buffer, so `_sosfiltfilt` filters with a copy
+    sos.flags.writeable = False
+    return sos
+
+
+def _sosfiltfilt(sos, x):
+    return scipy.signal.sosfiltfilt(sos.copy(), x, axis=-1)
+
+
+@functools.lru_cache(maxsize=FILTER_CACHE_SIZE)
+def _notch_sos(sr, f0, Q):
+    b, a = scipy.signal.iirnotch(f0, Q, fs=sr)
+    return _readonly(scipy.signal.tf2sos(b, a))
+
+
+@functools.lru_cache(maxsize=FILTER_CACHE_SIZE)
+def _band_sos(sr, band):
+    if band == 'audio':
+        low, high = AUDIO_BAND
+        if high < sr / 2.0:
+            sos = scipy.signal.butter(4, (low, high), btype='bandpass',
+                                      output='sos', fs=sr)
+        else:
+            sos = scipy.signal.butter(4, low, btype='highpass',
+                                      output='sos', fs=sr)
+    elif band == 'A':
+        # IEC 61672 A-weighting, bilinear transform normalized to 0 dB
+        # at 1 kHz
+        poles = 2 * np.pi * np.array([-20.598997, -20.598997, -107.65265,
+                                      -737.86223, -12194.217, -12194.217])
+        z, p, k = scipy.signal.bilinear_zpk(np.zeros(4), poles, 1.0, sr)
+        sos = scipy.signal.zpk2sos(z, p, k)
+        _, h = scipy.signal.sosfreqz(sos, worN=[1000.0], fs=sr)
+        sos[0, :3] /= np.abs(h[0])
+    else:
+        raise ParameterError('Invalid band: {!r}'.format(band))
+    return _readonly(sos)
+
+
+def filter_cache_info():
+    '''Cache statistics of the notch and band-limit filter designs.'''
+    return _notch_sos.cache_info(), _band_sos.cache_info()
+
+
+def filter_cache_clear():
+    '''Drop all cached notch and band-limit filter designs.'''
+    _notch_sos.cache_clear()
+    _band_sos.cache_clear()
+
+
+def notch_thd_n(y, sr, f0=1000, Q=10.0, band=None):
+    '''THD+N of a single tone by notching out the fundamental.
+
+    The fundamental is removed with a zero-phase IIR notch
+    (``scipy.signal.sosfiltfilt``) and the RMS of the residual is
+    compared to the RMS of the signal, all in the time domain.  Filter
+    designs are memoized by ``(sr, f0, Q)``, so repeated steps of a
+    stepped-tone test only pay for the filtering.
+
+    :param y: ``(..., samples)`` floating point audio; channels and
+        segments on the leading axes are measured at once
+    :param Q: quality factor of the notch, the -3 dB width is ``f0 / Q``
+    :param band: ``None``, ``'audio'`` (20 Hz - 20 kHz) or ``'A'``
+        (A-weighting) limit applied to the residual
+    :return: THD+N in percent, shape ``y.shape[:-1]``
+    '''
+    y = np.asarray(y)
+    lvs.valid_audio(y, mono=False)
+    if f0 <= 0 or f0 >= sr / 2.0:
+        raise ParameterError('f0={} outside (0, sr/2)'.format(f0))
+
+    y = y - np.mean(y, axis=-1, keepdims=True)
+    residual = _sosfiltfilt(_notch_sos(sr, float(f0), float(Q)), y)
+
+    # skip the settling time (5 time constants) at both ends
+    trim = int(np.ceil(5.0 * Q * sr / (np.pi * f0)))
+    if band is not None:
+        # single pass: sosfiltfilt would apply the weighting twice
+        residual = scipy.signal.sosfilt(_band_sos(sr, band).copy(),
+                                        residual, axis=-1)
+        settle = 5.0 * sr / (2 * np.pi * AUDIO_BAND[0])
+        trim = max(trim, int(np.ceil(settle)))
+    trim = min(trim, y.shape[-1] // 4)
+    y = y[..., trim:y.shape[-1] - trim]
+    residual = residual[..., trim:residual.shape[-1] - trim]
+
+    total = np.sqrt(np.mean(np.square(y), axis=-1))
+    noise = np.sqrt(np.mean(np.square(residual), axis=-1))
+    return 100.0 * noise / np.maximum(total, 1e-20)
+
+
+def analyze_sweep(filename, trigeFrequncy=400, stopananlysis=100, channel=1,
+                  **kwargs):
+    '''Analyze a high-to-low sweep tone recording.
+
+    Returns ``freq, thdh, thd_N, power, Freq_THD, thd_data, Freq_Power,
+    PowerS, RubBuzz_data``, see README.  Extra keyword arguments
+    (*n_fft*, *hop_length*, *number_harmonic*) are passed to
+    `analyze_sweep_data`.
+    '''
+    y, sr = load_channel(filename, channel)
+    return analyze_sweep_data(y, sr, trigeFrequncy, stopananlysis, **kwargs)
+
+
+def diplaychart(Freq_THD, thd_data, Freq_Power, PowerS, RubBuzz_data,
+                chart_name='sweep', channel=1, show=True):
+    '''Plot THD, rub&buzz and power against frequency (needs matplotlib).
+
+    The chart is saved as ``<chart_name>_channel_<channel>_THD_out.png``.
+    '''
+    import matplotlib.pyplot as plt
+
+    title = '{}_channel_{}'.format(chart_name, channel)
+    with plt.style.context('dark_background'):
+        fig, ax = plt.subplots(figsize=(20, 13.3))
+        l1, = ax.semilogx(Freq_THD, thd_data, label='THD')
+        l2, = ax.semilogx(Freq_THD, RubBuzz_data, color='b',
+                          label='rub&buzz')
+        ax.set_xlabel('Frequency [Hz]', fontsize=22)
+        ax.set_ylabel('THD [%]', fontsize=22)
+        ax2 = ax.twinx()
+        l3, = ax2.semilogx(Freq_Power, PowerS, color='r', label='power')
+        ax2.set_ylabel('Power dB Re 1v[dB]', fontsize=22)
+        ax2.grid(True)
+        ax.set_title('Sweep Tone Spectrum/THD__' + title, fontsize=22)
+        fig.legend(handles=[l1, l2, l3], loc='lower center', fontsize=14)
+        fig.text(0.95, 0.05, 'Copyright @ L_Rui', fontsize=32,
+                 color='gray', alpha=0.5, ha='right')
+        fig.savefig(title + '_THD_out.png')
+        if show:
+            plt.show()
+        plt.close(fig)
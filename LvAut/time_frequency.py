@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 '''Time and frequency utilities'''
 
+import functools
 import re
 import warnings
 
@@ -30,6 +31,7 @@ __all__ = ['frames_to_samples', 'frames_to_time',
            'mel_to_hz',
            'octs_to_hz',
            'fft_frequencies',
+           'hz_to_fft_bin', 'fft_bin_to_hz',
            'cqt_frequencies',
            'mel_frequencies',
            'tempo_frequencies',
@@ -266,12 +268,40 @@ def octs_to_hz(octs, tuning=0.0, bins_per_octave=12, A440=Deprecated()):
     return (float(A440) / 16)*(2.0**np.asanyarray(octs))
 
 
+@functools.lru_cache(maxsize=32)
+def _fft_grid(sr, n_fft):
+    # Shared between callers, so keep it read-only
+    freqs = np.linspace(0,
+                        float(sr) / 2,
+                        int(1 + n_fft//2),
+                        endpoint=True)
+    freqs.flags.writeable = False
+    return freqs
+
+
 def fft_frequencies(sr=22050, n_fft=2048):
 
-    return np.linspace(0,
-                       float(sr) / 2,
-                       int(1 + n_fft//2),
-                       endpoint=True)
+    return _fft_grid(float(sr), int(n_fft)).copy()
+
+
+def hz_to_fft_bin(frequencies, sr=22050, n_fft=2048):
+    '''Index of the FFT bin nearest to each frequency.
+
+    Same as ``np.abs(fft_frequencies(sr, n_fft) - f).argmin()`` for
+    every *f* (ties go to the lower bin), but computed arithmetically
+    and vectorized over any array of frequencies; out-of-range
+    frequencies are clipped to DC/Nyquist.
+    '''
+    freqs = _fft_grid(float(sr), int(n_fft))
+    # bin spacing of the fft_frequencies() grid
+    step = float(sr) / 2 / max(len(freqs) - 1, 1)
+    bins = np.ceil(np.asanyarray(frequencies) / step - 0.5)
+    return np.clip(bins, 0, len(freqs) - 1).astype(int)
+
+
+def fft_bin_to_hz(bins, sr=22050, n_fft=2048):
+    '''Center frequency of FFT bin indices, see `hz_to_fft_bin`.'''
+    return _fft_grid(float(sr), int(n_fft))[np.asanyarray(bins, dtype=int)]
 
 
 def cqt_frequencies(n_bins, fmin, bins_per_octave=12, tuning=0.0):
@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+'''Memory-mapped WAV reader
+   lorry rui , Newark , USA
+
+Parses RIFF/RIFX/RF64 WAVE headers in pure Python and maps the PCM data
+chunk with `numpy.memmap`; nothing is read until samples are used.
+`WavWriter` appends to a WAV/RF64 file for recording to disk.
+Channels are strided views of the map, and conversion to floating point
+is done block by block for the requested region only::
+
+    import LvAut.wavio as wavio
+    with wavio.WavFile('Device_Mic_THD_R_3.wav') as wav:
+        left = wav.channel(0)                  # lazy, no samples read
+        y = left[wav.samplerate:2 * wav.samplerate]  # 1 s as float32
+
+8 bit unsigned, 16/24/32 bit integer and 32/64 bit float PCM is
+supported, including WAVE_FORMAT_EXTENSIBLE.
+'''
+
+import os
+import struct
+
+import numpy as np
+
+from .lvspectrum import ParameterError
+
+
+__all__ = ['WavFile', 'WavWriter', 'read', 'info']
+
+# frames converted at once by WavFile.read / WavFile.blocks
+BLOCK_FRAMES = 2**16
+
+_WAVE_FORMAT_PCM = 0x0001
+_WAVE_FORMAT_IEEE_FLOAT = 0x0003
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# (format, bits per sample) -> (subtype, sample dtype without byte order)
+_formats = {
+    (_WAVE_FORMAT_PCM, 8): ('PCM_U8', 'u1'),
+    (_WAVE_FORMAT_PCM, 16): ('PCM_16', 'i2'),
+    (_WAVE_FORMAT_PCM, 24): ('PCM_24', 'u1'),
+    (_WAVE_FORMAT_PCM, 32): ('PCM_32', 'i4'),
+    (_WAVE_FORMAT_IEEE_FLOAT, 32): ('FLOAT', 'f4'),
+    (_WAVE_FORMAT_IEEE_FLOAT, 64): ('DOUBLE', 'f8'),
+}
+
+
+def _chunks(f, endian, file_size):
+    '''``(id, offset, size)`` of the chunks after the WAVE header.'''
+    offset = 12
+    while offset + 8 <= file_size:
+        f.seek(offset)
+        chunk_id, size = struct.unpack(endian + '4sI', f.read(8))
+        yield chunk_id, offset + 8, size
+        # chunks are word aligned
+        offset += 8 + size + (size & 1)
+
+
+def _parse(path):
+    with open(path, 'rb') as f:
+        f.seek(0, 2)
+        file_size = f.tell()
+        f.seek(0)
+        header = f.read(12)
+        if len(header) < 12:
+            raise ParameterError('{}: not a RIFF/RF64 WAVE file'.format(path))
+        riff, _, wave = struct.unpack('<4sI4s', header)
+        if riff not in (b'RIFF', b'RIFX', b'RF64') or wave != b'WAVE':
+            raise ParameterError('{}: not a RIFF/RF64 WAVE file'.format(path))
+        endian = '>' if riff == b'RIFX' else '<'
+
+        fmt, data, ds64_size = None, None, None
+        for chunk_id, offset, size in _chunks(f, endian, file_size):
+            f.seek(offset)
+            if chunk_id == b'ds64':
+                # RF64: 64 bit RIFF and data sizes
+                _, ds64_size = struct.unpack('<QQ', f.read(16))
+            elif chunk_id == b'fmt ':
+                fmt = f.read(min(size, 40))
+            elif chunk_id == b'data':
+                if ds64_size is not None and size == 0xFFFFFFFF:
+                    size = ds64_size
+                data = (offset, size)
+                break
+
+    if fmt is None or data is None:
+        raise ParameterError('{}: missing fmt or data chunk'.format(path))
+
+    tag, channels, samplerate, _, block_align, bits = struct.unpack(
+        endian + 'HHIIHH', fmt[:16])
+    if tag == _WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+        # the sub format GUID starts with the actual format tag
+        tag = struct.unpack(endian + 'H', fmt[24:26])[0]
+    try:
+        subtype, dtype = _formats[tag, bits]
+    except KeyError:
+        raise ParameterError('{}: unsupported format {:#06x} with {} bit'
+                             .format(path, tag, bits))
+    if block_align != channels * bits // 8:
+        raise ParameterError('{}: unsupported block alignment {}'
+                             .format(path, block_align))
+
+    offset, size = data
+    # unfinished recordings may carry a 0 or too large data size
+    if size == 0 or offset + size > file_size:
+        size = file_size - offset
+    frames = size // block_align
+    return dict(samplerate=samplerate, channels=channels, subtype=subtype,
+                dtype=np.dtype(endian + dtype), big_endian=endian == '>',
+                bits=bits, offset=offset, frames=frames)
+
+
+def info(path):
+    '''``(samplerate, channels, frames, subtype)`` of a WAV file.'''
+    header = _parse(path)
+    return (header['samplerate'], header['channels'], header['frames'],
+            header['subtype'])
+
+
+def _unpack24(raw, big_endian=False):
+    '''Sign-extend packed 24 bit samples (trailing axis of 3 bytes) to
+    int32, vectorized.'''
+    out = np.zeros(raw.shape[:-1] + (4,), dtype=np.uint8)
+    if big_endian:
+        out[..., :3] = raw
+        return out.view('>i4')[..., 0] >> 8
+    out[..., 1:] = raw
+    # the sample sits in the upper 3 bytes; the arithmetic shift
+    # sign-extends
+    return out.view('<i4')[..., 0] >> 8
+
+
+class WavFile(object):
+    '''A memory-mapped WAV file.
+
+    :ivar samplerate: sample rate [Hz]
+    :ivar channels: number of channels
+    :ivar frames: number of frames (samples per channel)
+    :ivar subtype: ``'PCM_U8'``, ``'PCM_16'``, ``'PCM_24'``,
+        ``'PCM_32'``, ``'FLOAT'`` or ``'DOUBLE'``
+    :ivar raw: memory map of the data chunk, shape ``(frames, channels)``
+        (``(frames, channels, 3)`` bytes for 24 bit)
+    '''
+
+    def __init__(self, path):
+        header = _parse(path)
+        self.path = path
+        self.samplerate = header['samplerate']
+        self.channels = header['channels']
+        self.frames = header['frames']
+        self.subtype = header['subtype']
+        self._bits = header['bits']
+        dtype = header['dtype']
+        self._big_endian = header['big_endian']
+        shape = (self.frames, self.channels)
+        if self.subtype == 'PCM_24':
+            shape += (3,)
+        if self.frames:
+            self.raw = np.memmap(path, dtype=dtype, mode='r',
+                                 offset=header['offset'], shape=shape)
+        else:
+            self.raw = np.zeros(shape, dtype=dtype)
+
+    def __repr__(self):
+        return 'WavFile({!r}, samplerate={}, channels={}, frames={}, ' \
+            'subtype={!r})'.format(self.path, self.samplerate,
+                                   self.channels, self.frames, self.subtype)
+
+    def __len__(self):
+        return self.frames
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        '''Release the memory map; views taken before keep it alive.'''
+        self.raw = None
+
+    def channel(self, index):
+        '''Lazy view of channel *index* (starting with 0).
+
+        Slicing the view converts only the selected frames, see
+        `read`.
+        '''
+        if not -self.channels <= index < self.channels:
+            raise ParameterError('Invalid channel: {}'.format(index))
+        return _ChannelView(self, index % self.channels)
+
+    def _convert(self, raw, dtype):
+        if self.subtype == 'PCM_24':
+            return _unpack24(raw, self._big_endian).astype(dtype) \
+                / dtype.type(2**23)
+        if self.subtype == 'PCM_U8':
+            return (raw.astype(dtype) - 128) / dtype.type(128)
+        if self.subtype in ('FLOAT', 'DOUBLE'):
+            return raw.astype(dtype)
+        return raw.astype(dtype) / dtype.type(2**(self._bits - 1))
+
+    def read(self, start=0, stop=None, channels=None, dtype=np.float32,
+             out=None):
+        '''Frames ``start:stop`` converted to floating point in [-1, 1).
+
+        :param channels: ``None`` for all channels (result ``(frames,
+            channels)``, or ``(frames,)`` for a mono file), an int for
+            one channel (result ``(frames,)``) or a list of channel
+            indices
+        :param out: optional preallocated output array of the result
+            shape and *dtype*
+        '''
+        dtype = np.dtype(dtype)
+        start, stop, _ = slice(start, stop).indices(self.frames)
+        stop = max(start, stop)
+        if channels is None and self.channels == 1:
+            channels = 0
+        raw = self.raw if channels is None else self.raw[:, channels]
+        shape = (stop - start,) + raw.shape[1:]
+        if self.subtype == 'PCM_24':
+            shape = shape[:-1]
+        if out is None:
+            out = np.empty(shape, dtype=dtype)
+        elif out.shape != shape:
+            raise ParameterError('out has shape {}, expected {}'
+                                 .format(out.shape, shape))
+
+        for bl_s in range(start, stop, BLOCK_FRAMES):
+            bl_t = min(bl_s + BLOCK_FRAMES, stop)
+            out[bl_s - start:bl_t - start] = self._convert(raw[bl_s:bl_t],
+                                                           dtype)
+        return out
+
+    def blocks(self, block_length=BLOCK_FRAMES, channels=None,
+               dtype=np.float32):
+        '''Iterate over the file in converted blocks of *block_length*
+        frames.'''
+        for bl_s in range(0, self.frames, block_length):
+            yield self.read(bl_s, bl_s + block_length, channels, dtype)
+
+
+class _ChannelView(object):
+    '''One channel of a `WavFile`, converted on slicing.'''
+
+    def __init__(self, wav, index):
+        self._wav = wav
+        self.index = index
+
+    def __len__(self):
+        return self._wav.frames
+
+    @property
+    def raw(self):
+        '''Strided view of this channel in the memory map (no copy).'''
+        return self._wav.raw[:, self.index]
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step not in (None, 1):
+            raise ParameterError('Channel views support contiguous slices '
+                                 'only')
+        return self._wav.read(key.start, key.stop, self.index)
+
+    def __array__(self, dtype=None, copy=None):
+        return self._wav.read(channels=self.index,
+                              dtype=dtype or np.float32)
+
+
+class WavWriter(object):
+    '''Append-only WAV writer for long recordings.
+
+    The header is written with placeholder sizes and a ``JUNK`` chunk
+    reserved for a ``ds64`` chunk; `sync` and `close` patch the sizes,
+    switching to RF64 when the data outgrows 4 GiB.  A file that was never
+    closed is still readable with `WavFile`, which falls back to the file
+    size.
+
+    :param subtype: ``'PCM_16'``, ``'PCM_24'``, ``'PCM_32'``, ``'FLOAT'``
+        or ``'DOUBLE'``
+    '''
+
+    _header = struct.Struct('<4sI4s4sI28s4sIHHIIHH4sI')
+
+    def __init__(self, path, samplerate, channels, subtype='PCM_24'):
+        formats = {subtype: key for key, (subtype, _) in _formats.items()}
+        if subtype not in formats or subtype == 'PCM_U8':
+            raise ParameterError('Invalid subtype: {!r}'.format(subtype))
+        self.path = path
+        self.samplerate = int(samplerate)
+        self.channels = int(channels)
+        self.subtype = subtype
+        self.frames = 0
+        self._tag, self._bits = formats[subtype]
+        self._file = open(path, 'wb')
+        self._write_header()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def closed(self):
+        return self._file is None
+
+    def _write_header(self):
+        block_align = self.channels * self._bits // 8
+        size = self.frames * block_align
+        rf64 = size + self._header.size > 0xFFFFFFFF
+        ds64 = struct.pack('<QQQI', self._header.size - 8 + size, size,
+                           self.frames, 0) if rf64 else bytes(28)
+        clip = 0xFFFFFFFF
+        header = self._header.pack(
+            b'RF64' if rf64 else b'RIFF',
+            clip if rf64 else self._header.size - 8 + size, b'WAVE',
+            b'ds64' if rf64 else b'JUNK', 28, ds64,
+            b'fmt ', 16, self._tag, self.channels, self.samplerate,
+            self.samplerate * block_align, block_align, self._bits,
+            b'data', clip if rf64 else size)
+        self._file.seek(0)
+        self._file.write(header)
+        self._file.seek(0, 2)
+
+    def _encode(self, data):
+        data = np.asarray(data)
+        if data.ndim < 2:
+            data = data.reshape((-1, 1))
+        if data.shape[1] != self.channels:
+            raise ParameterError('Expected {} channels, got {}'
+                                 .format(self.channels, data.shape[1]))
+        if self.subtype in ('FLOAT', 'DOUBLE'):
+            dtype = '<f{}'.format(self._bits // 8)
+            if data.dtype == np.uint8:
+                return (data.astype(dtype) - 128) / 128
+            if np.issubdtype(data.dtype, np.integer):
+                # integer samples are scaled from their own full scale
+                return data.astype(dtype) / -np.iinfo(data.dtype).min
+            return data.astype(dtype, copy=False)
+
+        if np.issubdtype(data.dtype, np.integer):
+            # integer samples are scaled from their own full scale
+            shift = self._bits - 8 * data.dtype.itemsize
+            if data.dtype == np.uint8:
+                # unsigned 8 bit is offset binary
+                data = data.astype('<i4') - 128
+            else:
+                data = data.astype('<i4')
+            data = data << shift if shift >= 0 else data >> -shift
+        else:
+            # float64: scale - 1 is not representable in float32 for PCM_32
+            scale = 2**(self._bits - 1)
+            data = np.clip(np.round(np.asarray(data, np.float64) * scale),
+                           -scale, scale - 1)
+            data = data.astype('<i4')
+        if self.subtype == 'PCM_16':
+            return data.astype('<i2')
+        if self.subtype == 'PCM_24':
+            return data.view(np.uint8).reshape(data.shape + (4,))[..., :3]
+        return data
+
+    def write(self, data):
+        '''Append frames; *data* is ``(frames, channels)`` (or
+        ``(frames,)`` for mono), floating point in [-1, 1) or integer.'''
+        encoded = self._encode(data)
+        self._file.write(np.ascontiguousarray(encoded).tobytes())
+        self.frames += len(encoded)
+
+    def sync(self):
+        '''Patch the header sizes and flush everything to disk.'''
+        self._write_header()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        '''Patch the header and close the file.'''
+        if self._file is None:
+            return
+        try:
+            if (self.frames * self.channels * self._bits // 8) & 1:
+                # pad byte of an odd-sized data chunk
+                self._file.write(b'\0')
+            self._write_header()
+        finally:
+            self._file.close()
+            self._file = None
+
+
+def read(path, start=0, stop=None, channels=None, dtype=np.float32):
+    '''Read frames ``start:stop`` of a WAV file as floating point.
+
+    :return: ``(signal, samplerate)``, see `WavFile.read`
+    '''
+    with WavFile(path) as wav:
+        return wav.read(start, stop, channels, dtype), wav.samplerate
@@ -1,6 +1,7 @@
 import LvAut.lvaut_THD as AUT
 import LvAut.lvspectrum as lvs
 import LvAut.lvdisplay as lvd
+from LvAut.time_frequency import hz_to_fft_bin
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -12,24 +13,10 @@ framesize=2048
 def samples_to_time(samples, sr=22050):
     return len(samples) / float(sr)
 
-def find_nearest(array, value):
-    array = np.asarray(array)
-    idx = (np.abs(array - value)).argmin()
-    return idx,array[idx]
+def tonal_area(sr,start_f,stop_f):
+    return tuple(hz_to_fft_bin([start_f,stop_f],sr,framesize))
 
 
-def tonal_area(freq,start_f,stop_f):
-    return find_nearest(freq,start_f)[0],find_nearest(freq,stop_f)[0]
-
-
-
-
-def fft_frequencies(sr=22050, n_fft=2048):
-    np.set_printoptions(suppress=True)
-    return np.linspace(0,
-                       float(sr) / 2,
-                       int(1 + n_fft//2),
-                       endpoint=True)
 
 
 def plot_spectrogram(Y, sr, hop_length,filename, y_axis="log"):
@@ -49,8 +36,7 @@ def tonal_noise(filename,area_start=2000,area_stop=5000,threshold=-40):
     y, sr, channels=AUT.load(filename)
     if channels > 1:
         y = y[:, 0]  ## channels 0=1, 1=2,
-    a=fft_frequencies(sr,framesize)
-    a1,a2=tonal_area(a,area_start,area_stop)
+    a1,a2=tonal_area(sr,area_start,area_stop)
     print(a1,a2)
     stft = lvs.stft(y[:], hop_length=HOP_SIZE, n_fft=framesize)
     sepctrogram = np.abs(stft)
@@ -69,14 +55,13 @@ def single_thd(filename,f_fundament=1000, number_harmonic=2):
     y, sr, channels=AUT.load(filename)
     if channels > 1:
         y = y[:, 0]  ## channels 0=1, 1=2,
-    a=fft_frequencies(sr,framesize)
     stft = lvs.stft(y[:], hop_length=HOP_SIZE, n_fft=framesize)
     sepctrogram = np.abs(stft)
     power_sepetrogram = lvs.amplitude_to_db(sepctrogram,ref=np.max)
-    f0=np.average(power_sepetrogram[find_nearest(a,f_fundament)[0]])
-    for i in range(2, 2+number_harmonic):
-        thd1 = (np.average(power_sepetrogram[find_nearest(a,f_fundament*number_harmonic)[0]]) - f0) / 10
-        thd += np.power(10, thd1)
+    f0=np.average(power_sepetrogram[hz_to_fft_bin(f_fundament,sr,framesize)])
+    harmonic_bins=hz_to_fft_bin(f_fundament*np.arange(2, 2+number_harmonic),sr,framesize)
+    thd1 = (np.average(power_sepetrogram[harmonic_bins],axis=1) - f0) / 10
+    thd = np.sum(np.power(10, thd1))
     thd = abs(round(np.sqrt(thd) * 100, 2))
     return f0,thd
 
@@ -1,6 +1,7 @@
 import LvAut.lvaut_THD as AUT
 import LvAut.lvspectrum as lvs
 import LvAut.lvdisplay as lvd
+from LvAut.time_frequency import hz_to_fft_bin
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -10,22 +11,8 @@ framesize=2048 ## FFT size , each step freq:44100/framesize
 
 
 
-def tonal_area(freq,start_f,stop_f):
-    return find_nearest(freq,start_f)[0],find_nearest(freq,stop_f)[0]
-
-def find_nearest(array, value):
-    array = np.asarray(array)
-    idx = (np.abs(array - value)).argmin()
-    return idx,array[idx]
-
-
-def fft_frequencies(sr=22050, n_fft=2048):
-    np.set_printoptions(suppress=True)
-    return np.linspace(0,
-                       float(sr) / 2,
-                       int(1 + n_fft//2),
-                       endpoint=True)
-
+def tonal_area(sr,start_f,stop_f):
+    return tuple(hz_to_fft_bin([start_f,stop_f],sr,framesize))
 
 def plot_spectrogram(Y, sr, hop_length,filename, y_axis="log"):
     fig=plt.figure(figsize=(15, 10)) #linear or log
@@ -44,8 +31,7 @@ def tonal_noise(filename,area_start=2000,area_stop=5000,threshold=-40):
     y, sr, channels=AUT.load(filename)
     if channels > 1:
         y = y[:, 0]  ## channels 0=1, 1=2,
-    a=fft_frequencies(sr,framesize)
-    a1,a2=tonal_area(a,area_start,area_stop)
+    a1,a2=tonal_area(sr,area_start,area_stop)
     stft = lvs.stft(y[:], hop_length=HOP_SIZE, n_fft=framesize)
     sepctrogram = np.abs(stft)
     log_sepetrogram = lvs.amplitude_to_db(sepctrogram,ref=np.max)
@@ -0,0 +1,55 @@
+import LvAut.device as sd
+import numpy as np
+import tracemalloc
+import time
+'''
+Allocations of blocking reads/writes: read()/write() against
+read_into()/write_from() on a preallocated block.
+Run with a duplex device, e.g. device="Microphone (Logitech Webcam C930e), Windows DirectSound"
+'''
+
+fs = 48000
+blocksize = 256
+blocks = 2000
+
+
+def measure(step):
+    for _ in range(50):  # warm up
+        step()
+    kept = [None] * blocks  # keep the results alive so every allocation is counted
+    tracemalloc.start()
+    snapshot = tracemalloc.take_snapshot()
+    start = time.perf_counter()
+    for i in range(blocks):
+        kept[i] = step()
+    elapsed = time.perf_counter() - start
+    stats = tracemalloc.take_snapshot().compare_to(snapshot, 'filename')
+    tracemalloc.stop()
+    count = sum(stat.count_diff for stat in stats if stat.count_diff > 0)
+    size = sum(stat.size_diff for stat in stats if stat.size_diff > 0)
+    return count, size, elapsed
+
+
+def benchmark(device=None, channels=2):
+    indata = np.zeros((blocksize, channels), dtype='float32')
+    outdata = np.zeros((blocksize, channels), dtype='float32')
+    with sd.Stream(samplerate=fs, blocksize=blocksize, device=device,
+                   channels=channels, dtype='float32') as stream:
+        def allocating():
+            data, overflowed = stream.read(blocksize)
+            stream.write(outdata)
+            return data
+
+        def preallocated():
+            overflowed = stream.read_into(indata)
+            stream.write_from(outdata)
+            return overflowed
+
+        for name, step in ('read/write', allocating), ('read_into/write_from', preallocated):
+            count, size, elapsed = measure(step)
+            print('{:22s} {:6d} blocks: {:6d} live allocations, {:9d} bytes, {:6.1f} us/block'.format(
+                name, blocks, count, size, 1e6 * elapsed / blocks))
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,50 @@
+import LvAut.device as sd
+import numpy as np
+'''
+Time spent in the play()/rec()/playrec() callbacks for many channels and
+small blocks, without a device: the callback context is driven with
+synthetic buffers and its callback_time/callback_max instrumentation is
+printed.  The default (identity) mapping is a single slice copy, a
+mapping of up to two runs of consecutive channels one slice copy per run,
+and a scattered mapping a single fancy-indexed copy.
+After a real sd.playrec(...); sd.wait() the same numbers are in
+sd._last_callback.callback_time etc.
+'''
+
+channels = 16
+blocksize = 64
+blocks = 20000
+
+
+def run(mapping=None, loop_period=None):
+    ctx = sd._CallbackContext(loop=loop_period is not None)
+    frames = blocksize * blocks
+    if loop_period is None:
+        data = np.zeros((frames, channels), dtype='float32')
+    else:
+        data = np.zeros((loop_period, channels), dtype='float32')
+    ctx.frames = ctx.check_data(data, mapping, None)
+    if loop_period is None:
+        ctx.check_out(None, frames, channels, 'float32', mapping)
+    indata = np.zeros((blocksize, channels), dtype='float32')
+    outdata = np.zeros((blocksize, channels), dtype='float32')
+    status = sd.CallbackFlags()
+    for _ in range(blocks):
+        ctx.callback_enter(status, outdata)
+        if loop_period is None:
+            ctx.read_indata(indata)
+        ctx.write_outdata(outdata)
+        ctx.callback_exit()
+    return ctx
+
+
+if __name__ == '__main__':
+    identity = list(range(1, channels + 1))
+    scattered = identity[::2] + identity[1::2]
+    for name, kwargs in [('identity mapping', {}),
+                         ('scattered mapping', dict(mapping=scattered)),
+                         ('loop, 48 frame period', dict(loop_period=48))]:
+        ctx = run(**kwargs)
+        print('{:22s} {} ch x {} frames: mean {:6.1f} us, max {:7.1f} us per callback'.format(
+            name, channels, blocksize, 1e6 * ctx.callback_time / ctx.callback_count,
+            1e6 * ctx.callback_max))
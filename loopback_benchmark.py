@@ -0,0 +1,44 @@
+import os
+os.environ.setdefault('LVAUT_AUDIO_BACKEND', 'loopback')
+os.environ.setdefault('LVAUT_LOOPBACK_CLOCK', 'free')
+import LvAut.loopback as lb
+import LvAut.device as sd
+import LvAut.thd as AUT
+import numpy as np
+import time
+'''
+End-to-end throughput of capture plus analysis without audio hardware:
+1 kHz tone through the simulated DUT of LvAut.loopback (free-running
+clock), THD+N of every capture.
+LVAUT_LOOPBACK_CLOCK=realtime paces the captures like a real device.
+'''
+
+fs = 48000
+seconds = 1.0
+captures = 20
+
+
+def benchmark(channels=1):
+    lb.configure(dut=lb.DUTModel(delay=0.003, gain=-6,
+                                 response=[(20, -12), (100, 0), (10000, 0), (20000, -6)],
+                                 harmonics={2: 0.01, 3: 0.003}, noise=-90, seed=0))
+    tone = 0.9 * np.sin(2 * np.pi * 1000 * np.arange(int(seconds * fs)) / fs)
+    tone = tone.astype('float32')
+    capture_time = analysis_time = 0.0
+    with sd.Session(samplerate=fs, channels=channels) as session:
+        for _ in range(captures):
+            start = time.perf_counter()
+            y = session.playrec(tone)
+            analysis_start = time.perf_counter()
+            thd_n = AUT.notch_thd_n(y[int(0.1 * fs):].T, fs, f0=1000)
+            capture_time += analysis_start - start
+            analysis_time += time.perf_counter() - analysis_start
+    audio = captures * seconds
+    print('{} captures of {} s, {} channel(s): THD+N {} %'.format(
+        captures, seconds, channels, np.round(thd_n, 3)))
+    print('capture  {:7.3f} s ({:6.1f} x real time)'.format(capture_time, audio / capture_time))
+    print('analysis {:7.3f} s ({:6.1f} x real time)'.format(analysis_time, audio / analysis_time))
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -17,6 +17,7 @@ import sys,time
 import numpy as np
 
 import LvAut.lvaut_THD as AUT
+import LvAut.limits as limits
 from matplotlib import pyplot as plt
 
 
@@ -42,22 +43,17 @@ outfilename='Device_Mic_THD_R_3.wav'
 
 
 def checkdata(freq,data,start_Freq,end_Freq,lowlimit,uplimit):
-    output1=[]
-    output2=[]
-    
-    for i,ele in enumerate(freq):
-        if ele >start_Freq  and  ele < end_Freq:
-            
-            output1.append(ele)
-            output2.append(data[i])
-    maxval=max(output2)
-    minval=min(output2)
-    if maxval <lowlimit or  maxval > uplimit:
-        result="fail"
-        return output1,output2,maxval,minval,result
-    else:
-        result="pass"
-        return output1,output2,maxval,minval,result
+    freq=np.asarray(freq)
+    data=np.asarray(data)
+    inrange=(freq >start_Freq) & (freq < end_Freq)
+    output1=freq[inrange]
+    output2=data[inrange]
+    maxval=np.max(output2)
+    minval=np.min(output2)
+    ### every point in range must be within the limits, not only the max
+    check=limits.range_limit(start_Freq,end_Freq,lowlimit,uplimit).check(output1,output2)
+    result="pass" if check.passed else "fail"
+    return output1,output2,maxval,minval,result
         
 
 